@@ -0,0 +1,302 @@
+# BibleProject 下载器基准测试：本地模拟下载页面和视频服务器，
+# 分别用不同引擎和并发数运行 bible_download_videos.py，统计吞吐、单文件耗时分位数和每 GB 的 CPU 时间
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bible_download_videos import parse_rate, _format_bytes
+
+try:  # Windows 没有 resource 模块，此时不统计 CPU 时间
+    import resource
+except ImportError:
+    resource = None
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bible_download_videos.py")
+CHUNK_SIZE = 64 * 1024
+# 视频内容按位置生成：第 i 个视频在偏移 p 处的字节为 (i + p) % 256，不占内存且支持任意 Range
+PATTERN = bytes(range(256)) * (CHUNK_SIZE // 256 + 1)
+LAST_MODIFIED = "Mon, 01 Jan 2024 00:00:00 GMT"  # 模拟视频的固定修改时间
+
+class StandInConfig:
+    """模拟服务器的参数"""
+
+    def __init__(self, files, size, categories, latency, bandwidth, fail_rate, ranges, seed, weak_etag=False):
+        self.files = files
+        self.size = size
+        self.categories = categories
+        self.latency = latency  # 每个响应发送前的延迟（秒）
+        self.bandwidth = bandwidth  # 每个连接的带宽上限（字节/秒），0 表示不限
+        self.fail_rate = fail_rate  # 视频请求注入失败的概率（503 或传输中途断开）
+        self.ranges = ranges  # 是否支持 Range
+        self.weak_etag = weak_etag  # 是否只发弱 ETag（W/"…"），此时 If-Range 只能用 Last-Modified
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def video_size(self, index):
+        """各视频大小在 size 的 50%~150% 之间，按序号确定，多次运行一致"""
+        return max(1, int(self.size * (0.5 + (index * 7919 % 101) / 100)))
+
+    def should_fail(self):
+        with self.lock:
+            return self.random.random() < self.fail_rate
+
+    def page(self, base_url):
+        """生成与真实下载页面结构相同的 HTML，视频链接为 base_url 下的绝对地址"""
+        parts = ["<html><body>"]
+        per_category = -(-self.files // self.categories)
+        for category in range(self.categories):
+            parts.append(f'<div class="intl-downloads-group">'
+                         f'<div class="intl-downloads-group-title">类别 {category}</div>')
+            for index in range(category * per_category, min((category + 1) * per_category, self.files)):
+                parts.append(f'<div class="intl-downloads-item">'
+                             f'<div class="intl-downloads-item-title">视频 {index}</div>'
+                             f'<a href="{base_url}/videos/{index}.mp4">下载</a></div>')
+            parts.append("</div>")
+        parts.append("</body></html>")
+        return "".join(parts).encode("utf-8")
+
+def make_handler(config):
+    class StandInHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # 支持长连接，才能测出连接复用的效果
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_HEAD(self):
+            self.handle_request(send_body=False)
+
+        def do_GET(self):
+            self.handle_request(send_body=True)
+
+        def handle_request(self, send_body):
+            if config.latency:
+                time.sleep(config.latency)
+            if self.path.startswith("/downloads"):
+                self.send_page(send_body)
+            elif self.path.startswith("/videos/") and self.path.endswith(".mp4"):
+                try:
+                    index = int(self.path[len("/videos/"):-len(".mp4")])
+                except ValueError:
+                    index = -1
+                if 0 <= index < config.files:
+                    self.send_video(index, send_body)
+                    return
+                self.send_error(404)
+            else:
+                self.send_error(404)
+
+        def send_page(self, send_body):
+            host, port = self.server.server_address[:2]
+            page = config.page(f"http://{host}:{port}")
+            page_etag = f'"page-{len(page)}"'
+            if self.headers.get("If-None-Match") == page_etag:
+                self.send_response(304)
+                self.send_header("ETag", page_etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(page)))
+            self.send_header("ETag", page_etag)
+            self.end_headers()
+            if send_body:
+                self.wfile.write(page)
+
+        def send_video(self, index, send_body):
+            size = config.video_size(index)
+            etag = f'{"W/" if config.weak_etag else ""}"{index}-{size}"'
+            start, end = 0, size - 1
+            status = 200
+            byte_range = self.headers.get("Range")
+            if_range = self.headers.get("If-Range")
+            # 与 RFC 9110 一致：弱 ETag 永远不满足 If-Range
+            validators = (None, LAST_MODIFIED) if config.weak_etag else (None, etag, LAST_MODIFIED)
+            if config.ranges and byte_range and byte_range.startswith("bytes=") and if_range in validators:
+                first, _, last = byte_range[len("bytes="):].partition("-")
+                start = int(first)
+                end = min(int(last), size - 1) if last else size - 1
+                if start >= size:
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{size}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                status = 206
+
+            failing = send_body and config.should_fail()
+            if failing and config.random.random() < 0.5:
+                self.send_response(503)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            self.send_response(status)
+            self.send_header("Content-Type", "video/mp4")
+            self.send_header("Content-Length", str(end - start + 1))
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", LAST_MODIFIED)
+            if config.ranges:
+                self.send_header("Accept-Ranges", "bytes")
+            if status == 206:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            self.end_headers()
+            if not send_body:
+                return
+
+            # 注入的另一半失败：发送一半数据后断开连接
+            stop = start + (end - start + 1) // 2 if failing else end + 1
+            position = start
+            started = time.monotonic()
+            sent = 0
+            while position < stop:
+                count = min(CHUNK_SIZE, stop - position)
+                offset = (index + position) % 256
+                self.wfile.write(PATTERN[offset:offset + count])
+                position += count
+                sent += count
+                if config.bandwidth:
+                    ahead = sent / config.bandwidth - (time.monotonic() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+            if failing:
+                self.close_connection = True
+
+    return StandInHandler
+
+def start_server(config, port=0):
+    """在后台线程启动模拟服务器，返回 (server, 下载页面 URL)"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(config))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="stand-in", daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/downloads/"
+
+def percentile(values, fraction):
+    """线性插值分位数，values 为空时返回 None"""
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+def run_case(url, engine, workers, extra_args):
+    """用子进程跑一次完整下载，返回结果字典"""
+    work_dir = tempfile.mkdtemp(prefix="bible-bench-")
+    metrics_path = os.path.join(work_dir, "metrics.jsonl")
+    command = [
+        sys.executable, SCRIPT,
+        "--url", url, "--dir", os.path.join(work_dir, "videos"), "--proxy", "",
+        "--engine", engine, "--workers", str(workers),
+        "--no-ledger", "--refresh", "--metrics", metrics_path,
+        *extra_args,
+    ]
+    usage_before = resource.getrusage(resource.RUSAGE_CHILDREN) if resource else None
+    started = time.monotonic()
+    result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    elapsed = time.monotonic() - started
+    cpu = None
+    if resource:
+        usage_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu = (usage_after.ru_utime - usage_before.ru_utime) + (usage_after.ru_stime - usage_before.ru_stime)
+
+    records = []
+    if os.path.exists(metrics_path):
+        with open(metrics_path, "r", encoding="utf-8") as f:
+            records = [json.loads(line) for line in f if line.strip()]
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    done = [record for record in records if record["status"] == "done"]
+    total_bytes = sum(record["bytes"] for record in done)
+    latencies = [record["seconds"] for record in done]
+    return {
+        "engine": engine,
+        "workers": workers,
+        "returncode": result.returncode,
+        "files": len(done),
+        "failed": len(records) - len(done),
+        "retries": sum(record.get("retries") or 0 for record in records),
+        "bytes": total_bytes,
+        "seconds": round(elapsed, 3),
+        "throughput": total_bytes / elapsed if elapsed > 0 else 0.0,
+        "p50": percentile(latencies, 0.5),
+        "p99": percentile(latencies, 0.99),
+        "cpu_per_gb": cpu / (total_bytes / 1024 ** 3) if total_bytes and cpu is not None else None,
+        "stderr": result.stderr.strip().splitlines()[-1:] if result.returncode else [],
+    }
+
+def format_row(row):
+    def seconds(value):
+        return f"{value:.3f}s" if value is not None else "--"
+    cpu = f"{row['cpu_per_gb']:.1f}s" if row["cpu_per_gb"] is not None else "--"
+    return (f"{row['engine']:<7}{row['workers']:>6}{row['files']:>7}{row['failed']:>6}{row['retries']:>6}"
+            f"{_format_bytes(row['throughput']) + '/s':>14}{seconds(row['p50']):>10}{seconds(row['p99']):>10}"
+            f"{cpu:>10}{row['seconds']:>9.2f}s")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="BibleProject 下载器本地基准测试")
+    parser.add_argument("--files", type=int, default=40, help="模拟视频数量")
+    parser.add_argument("--size", default="4M", help="视频平均大小，支持 K/M/G 后缀")
+    parser.add_argument("--categories", type=int, default=4, help="类别数量")
+    parser.add_argument("--latency", type=float, default=0.02, help="每个响应的额外延迟（秒）")
+    parser.add_argument("--bandwidth", default="0", help="每个连接的带宽上限，支持 K/M/G 后缀；0 表示不限")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="视频请求注入失败的概率")
+    parser.add_argument("--no-range", action="store_true", help="模拟不支持 Range 的服务器")
+    parser.add_argument("--weak-etag", action="store_true", help="模拟只发弱 ETag 的服务器")
+    parser.add_argument("--seed", type=int, default=1, help="失败注入的随机种子")
+    parser.add_argument("--engines", default="thread,async", help="逗号分隔的引擎列表")
+    parser.add_argument("--workers", default="4,10,50", help="逗号分隔的并发数列表")
+    parser.add_argument("--json", default=None, help="把结果写入该 JSON 文件")
+    parser.add_argument("--serve", action="store_true", help="只启动模拟服务器，不运行基准测试")
+    parser.add_argument("--port", type=int, default=0, help="--serve 时监听的端口")
+    parser.add_argument("extra", nargs=argparse.REMAINDER,
+                        help="-- 之后的参数原样传给 bible_download_videos.py，如 -- --order shortest")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = StandInConfig(args.files, parse_rate(args.size), args.categories, args.latency,
+                           parse_rate(args.bandwidth), args.fail_rate, not args.no_range, args.seed,
+                           args.weak_etag)
+    server, url = start_server(config, args.port)
+
+    if args.serve:
+        print(f"模拟服务器已启动: {url}，按 Ctrl+C 退出")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
+        return
+
+    extra = [arg for arg in args.extra if arg != "--"]
+    print(f"{args.files} 个视频，平均 {_format_bytes(config.size)}，延迟 {args.latency}s，"
+          f"带宽上限 {args.bandwidth}/连接，失败率 {args.fail_rate}")
+    print(f"{'engine':<7}{'workers':>6}{'files':>7}{'fail':>6}{'retry':>6}"
+          f"{'throughput':>14}{'p50':>10}{'p99':>10}{'cpu/GB':>10}{'wall':>10}")
+    rows = []
+    for engine in args.engines.split(","):
+        for workers in args.workers.split(","):
+            row = run_case(url, engine.strip(), int(workers), extra)
+            rows.append(row)
+            print(format_row(row))
+            if row["stderr"]:
+                print(f"  退出码 {row['returncode']}: {row['stderr'][0]}")
+    server.shutdown()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
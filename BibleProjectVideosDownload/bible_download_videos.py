@@ -1,88 +1,1675 @@
 import os
+import argparse
+import asyncio
+import codecs
+import hashlib
+import json
+import sqlite3
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
+from html.parser import HTMLParser
 import concurrent.futures
 import re
-from tqdm import tqdm
+import shutil
+import sys
+import threading
+import time
 
 # 配置参数
 URL = "https://bibleproject.com/locale/downloads/zhs/"  # 目标网页
+LOCALE_URL = "https://bibleproject.com/locale/downloads/{locale}/"  # 多语言模式下各语言的下载页面
 DOWNLOAD_DIR = "g:/videos"  # 下载目录
 MAX_WORKERS = 10  # 最大并发线程数
 PROXY = "http://127.0.0.1:7880"  # Clash 代理地址
+PART_SUFFIX = ".part"  # 未完成下载的临时文件后缀
+SEGMENTS = 4  # 分段下载的并发连接数，设为 1 则始终单连接下载
+SEGMENT_MIN_SIZE = 16 * 1024 * 1024  # 小于该大小的文件不分段
+SEGMENT_SUFFIX = ".seg"  # 分段下载的临时文件后缀（预分配文件，各分段进度记在 .seg.state 中）
+SEGMENT_STATE_SUFFIX = ".state"  # 分段下载进度文件的后缀，加在 .seg 文件名之后
+ASYNC_CONCURRENCY = 200  # asyncio 引擎的最大并发下载数
+ASYNC_WRITE_BUFFER = 1024 * 1024  # asyncio 引擎攒够该大小再写盘
+BANDWIDTH_LIMIT = 0  # 全局带宽上限（字节/秒），0 表示不限速
+ADAPTIVE_MIN_WORKERS = 2  # 自适应并发的下限
+ADAPTIVE_MAX_WORKERS = 64  # 自适应并发的上限
+ADAPTIVE_INTERVAL = 5.0  # 自适应并发的调整周期（秒）
+ADAPTIVE_ERROR_RATE = 0.1  # 一个周期内失败占比超过该值即减半并发
+ADAPTIVE_DROP = 0.8  # 一个周期的吞吐低于上一周期的该比例时并发减一
+LEDGER_FILE = "ledger.sqlite3"  # 任务台账文件名，放在下载目录下
+CATALOG_CACHE_FILE = "catalog_cache.json"  # 下载页面解析结果缓存，放在下载目录下
+MANIFEST_FILE = "manifest.json"  # 每个类别目录下记录各视频 sha256 和大小的清单
+VERIFY_BUFFER = 8 * 1024 * 1024  # 校验时每次读取的字节数
+READ_BUFFER = 1024 * 1024  # 从连接读取数据的可复用缓冲区大小
+WRITE_BLOCK = 8 * 1024 * 1024  # 攒够该大小再写盘
+FSYNC_MODE = "end"  # 落盘策略：end 下载完成时 fsync；none 交给操作系统
+PROGRESS_INTERVAL = 2.0  # 汇总进度的刷新周期（秒）
+RETRIES = 5  # 连接失败或 5xx 时的重试次数
+BACKOFF_FACTOR = 0.5  # 重试退避系数：0.5s, 1s, 2s, ...
+RETRY_STATUSES = (429, 500, 502, 503, 504)  # 需要退避重试的响应状态码
+
+_thread_local = threading.local()
+_sessions = []  # 所有线程创建过的会话，用于汇总连接复用统计
+_sessions_lock = threading.Lock()
+_segment_executor = None
+_segment_executor_lock = threading.Lock()
+_worker_executor = None
+_worker_executor_lock = threading.Lock()
+_manifest_lock = threading.Lock()
+_head_cache = {}  # URL -> _head 的结果，同一次运行中排序、去重、分段下载共用，每个 URL 只 HEAD 一次
+_rate_limiter = None  # 全局令牌桶，设置 BANDWIDTH_LIMIT 后由 main 创建
+_controller = None  # 自适应并发控制器，--adaptive 时由 main 创建
+_ledger = None  # 任务台账，main 中打开
+_catalog_cache = None  # 下载页面缓存，main 中打开
+_progress = None  # 汇总进度显示，main 中创建
+_metrics = None  # JSON Lines 指标输出，指定 --metrics 时由 main 创建
+
+class JobLedger:
+    """SQLite 任务台账：记录每个 (类别, 标题, URL) 的状态、已下载字节、大小、ETag 和 sha256。
+    WAL 模式且每次更新立即提交，进程崩溃后台账仍与磁盘一致；多线程共用一个连接，由锁串行化"""
+    
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                category TEXT NOT NULL,
+                title TEXT NOT NULL,
+                url TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                bytes_done INTEGER NOT NULL DEFAULT 0,
+                size INTEGER,
+                etag TEXT,
+                sha256 TEXT,
+                error TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (category, title)
+            )"""
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+        self.conn.commit()
+    
+    def update(self, category, title, url, **fields):
+        """插入或更新一条任务记录，fields 为要修改的列；台账关闭后调用直接忽略
+        （再次 Ctrl+C 时 main 不再等待下载线程，它们可能在台账关闭后才结束）"""
+        fields["url"] = url
+        fields["updated_at"] = time.time()
+        columns = ", ".join(fields)
+        placeholders = ", ".join("?" for _ in fields)
+        assignments = ", ".join(f"{column} = excluded.{column}" for column in fields)
+        with self.lock:
+            if self.conn is None:
+                return
+            self.conn.execute(
+                f"INSERT INTO jobs (category, title, {columns}) VALUES (?, ?, {placeholders}) "
+                f"ON CONFLICT (category, title) DO UPDATE SET {assignments}",
+                (category, title, *fields.values()),
+            )
+            self.conn.commit()
+    
+    def pending(self, catalog):
+        """过滤出需要下载的条目：台账里没有、未完成或 URL 已变化的。
+        条目为 (类别, 标题, URL) 或带语言的 (类别, 标题, URL, 语言)。
+        为避免逐个 stat 文件，已完成的条目不再检查磁盘：文件被删除或 --verify 报告损坏时，
+        删掉坏文件后用 --no-ledger 运行一次即可重新下载"""
+        with self.lock:
+            done = {
+                (category, title): url
+                for category, title, url in self.conn.execute(
+                    "SELECT category, title, url FROM jobs WHERE status = 'done'")
+            }
+        # 返回生成器，流式解析出的条目可以边过滤边提交
+        return (
+            item for item in catalog
+            if done.get((_ledger_category(item[0], *item[3:]), item[1])) != item[2]
+        )
+    
+    def known_contents(self, catalog):
+        """返回台账中已完成且 URL 未变的条目 {条目: (大小, ETag)}，供去重直接使用，不必再 stat 或 HEAD"""
+        with self.lock:
+            done = {
+                (category, title): (url, size, etag)
+                for category, title, url, size, etag in self.conn.execute(
+                    "SELECT category, title, url, size, etag FROM jobs WHERE status = 'done'")
+            }
+        known = {}
+        for item in catalog:
+            url, size, etag = done.get((_ledger_category(item[0], *item[3:]), item[1]), (None, None, None))
+            if url == item[2]:
+                known[item] = (size or 0, etag)
+        return known
+    
+    def failures(self):
+        """返回失败任务列表 [(类别, 标题, URL, 错误信息, 已下载字节)]"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT category, title, url, error, bytes_done FROM jobs "
+                "WHERE status = 'failed' ORDER BY category, title").fetchall()
+    
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+class CatalogCache:
+    """下载页面的条件请求缓存：按页面 URL 保存 ETag / Last-Modified 和解析出的条目，
+    页面未变化（304）时直接复用，不再下载和解析"""
+    
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+    
+    def open(self, url):
+        """获取页面，返回 (条目迭代器, 是否有变化)。页面有变化时边下载边解析，
+        迭代完后才把新的解析结果写入缓存"""
+        with self.lock:
+            entry = self.entries.get(url)
+        headers = {}
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        
+        response = get_session().get(url, headers=headers, stream=True)
+        if response.status_code == 304 and entry:
+            response.close()
+            return iter([tuple(item) for item in entry["items"]]), False
+        response.raise_for_status()
+        
+        def generate():
+            catalog = []
+            for item in iter_catalog(response):
+                catalog.append(item)
+                yield item
+            with self.lock:
+                self.entries[url] = {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    "items": catalog,
+                }
+        return generate(), True
+    
+    def save(self):
+        """原子写回缓存文件"""
+        with self.lock:
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, ensure_ascii=False)
+            os.replace(temp_path, self.path)
+
+def open_catalog(url):
+    """获取下载页面，启用缓存时走条件请求；返回 (条目迭代器, 是否有变化)"""
+    if _catalog_cache is not None:
+        return _catalog_cache.open(url)
+    response = get_session().get(url, stream=True)
+    response.raise_for_status()
+    return iter_catalog(response), True
+
+def fetch_catalog(url):
+    """同 open_catalog，但一次解析完，返回 (条目列表, 是否有变化)"""
+    items, changed = open_catalog(url)
+    return list(items), changed
+
+def _ledger_category(category, locale=None):
+    """台账里的类别名；多语言模式下加上语言前缀，避免不同语言的同名视频冲突"""
+    return f"{locale}/{category}" if locale else category
+
+def _record(category, title, url, **fields):
+    """写台账；未启用台账时忽略"""
+    if _ledger is not None:
+        _ledger.update(category, title, url, **fields)
+
+class TokenBucket:
+    """线程安全的令牌桶限速器，所有下载线程共享同一个桶"""
+    
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)  # 默认允许一秒的突发
+        self.tokens = self.capacity
+        self.timestamp = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def reserve(self, amount):
+        """预扣 amount 个令牌，返回调用方需要等待的秒数（令牌不足时允许透支）"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.timestamp) * self.rate)
+            self.timestamp = now
+            self.tokens -= amount
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+    
+    def consume(self, amount):
+        """阻塞直到 amount 个令牌可用"""
+        delay = self.reserve(amount)
+        if delay > 0:
+            time.sleep(delay)
+
+class AdaptiveConcurrency:
+    """AIMD 并发控制器：周期性统计总吞吐和失败率，
+    无失败且吞吐未到带宽上限时并发加一，吞吐明显下降时减一，失败率过高时并发减半"""
+    
+    def __init__(self, initial, minimum, maximum, ceiling=0, interval=ADAPTIVE_INTERVAL):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.ceiling = ceiling  # 带宽上限（字节/秒），0 表示不限速
+        self.interval = interval
+        self.active = 0
+        self.bytes = 0
+        self.successes = 0
+        self.failures = 0
+        self.last_throughput = 0.0
+        self.condition = threading.Condition()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="adaptive", daemon=True)
+        self.thread.start()
+    
+    def acquire(self):
+        """等待一个并发名额（名额数量随 limit 动态变化）"""
+        with self.condition:
+            while self.active >= self.limit:
+                self.condition.wait()
+            self.active += 1
+    
+    def release(self, ok):
+        """归还名额并记录本次下载是否成功"""
+        with self.condition:
+            self.active -= 1
+            if ok:
+                self.successes += 1
+            else:
+                self.failures += 1
+            self.condition.notify()
+    
+    def record_bytes(self, amount):
+        with self.condition:
+            self.bytes += amount
+    
+    def stop(self):
+        self.stopped.set()
+    
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            with self.condition:
+                throughput = self.bytes / self.interval
+                finished = self.successes + self.failures
+                error_rate = self.failures / finished if finished else 0.0
+                self.bytes = self.successes = self.failures = 0
+                
+                if error_rate > ADAPTIVE_ERROR_RATE:
+                    # 乘性减：服务器或代理已经吃不消
+                    self.limit = max(self.minimum, self.limit // 2)
+                elif throughput < self.last_throughput * ADAPTIVE_DROP or (not throughput and self.active):
+                    # 吞吐掉了下来（或有下载在跑却一个字节都没收到）：
+                    # 多出来的线程在抢同一条链路或拖慢服务器，退回一步
+                    self.limit = max(self.minimum, self.limit - 1)
+                elif not throughput:
+                    # 没有下载在跑，没有可比较的数据
+                    pass
+                elif self.ceiling and throughput >= self.ceiling * 0.95:
+                    # 已贴住带宽上限，再加线程只会互相抢带宽
+                    pass
+                elif throughput >= self.last_throughput * 1.05 or self.ceiling:
+                    # 加性增：吞吐还在上涨（或离上限还远）
+                    self.limit = min(self.maximum, self.limit + 1)
+                self.last_throughput = throughput
+                self.condition.notify_all()
+
+class ProgressReporter:
+    """所有下载共用的汇总进度：数据块只累加计数器，由定时线程每 interval 秒
+    输出一行总字节数、速率和预计剩余时间，代替每个视频一个 tqdm 进度条"""
+    
+    def __init__(self, interval=PROGRESS_INTERVAL, stream=None):
+        self.interval = interval
+        self.stream = stream or sys.stderr
+        self.lock = threading.Lock()
+        self.total_bytes = 0  # 已知大小的待传输字节数（开始传输时才知道大小）
+        self.done_bytes = 0
+        self.total_files = 0
+        self.done_files = 0
+        self.failed_files = 0
+        self.rate = 0.0
+        self.started = time.monotonic()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="progress", daemon=True)
+    
+    def start(self):
+        self.thread.start()
+    
+    def add_files(self, count=1):
+        with self.lock:
+            self.total_files += count
+    
+    def add_bytes(self, amount):
+        with self.lock:
+            self.total_bytes += amount
+    
+    def advance(self, amount):
+        with self.lock:
+            self.done_bytes += amount
+    
+    def file_done(self, ok):
+        with self.lock:
+            if ok:
+                self.done_files += 1
+            else:
+                self.failed_files += 1
+    
+    def stop(self):
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self._print(final=True)
+    
+    def _run(self):
+        last_bytes = 0
+        last_time = time.monotonic()
+        while not self.stopped.wait(self.interval):
+            now = time.monotonic()
+            with self.lock:
+                done = self.done_bytes
+            # 指数平滑的瞬时速率，避免 ETA 大幅跳动
+            current = (done - last_bytes) / max(now - last_time, 1e-6)
+            self.rate = current if not self.rate else 0.7 * self.rate + 0.3 * current
+            last_bytes, last_time = done, now
+            self._print()
+    
+    def _print(self, final=False):
+        with self.lock:
+            done_bytes, total_bytes = self.done_bytes, self.total_bytes
+            done_files, failed_files, total_files = self.done_files, self.failed_files, self.total_files
+        if final:
+            elapsed = time.monotonic() - self.started
+            rate = done_bytes / elapsed if elapsed > 0 else 0.0
+            eta = "--"
+        else:
+            rate = self.rate
+            remaining = max(total_bytes - done_bytes, 0)
+            eta = _format_seconds(remaining / rate) if rate > 0 else "--"
+        line = (f"文件 {done_files}/{total_files}（失败 {failed_files}）  "
+                f"{_format_bytes(done_bytes)}/{_format_bytes(total_bytes)}  "
+                f"{_format_bytes(rate)}/s  剩余 {eta}")
+        if self.stream.isatty() and not final:
+            self.stream.write("\r\033[K" + line)
+        else:
+            self.stream.write(("\r\033[K" if self.stream.isatty() else "") + line + "\n")
+        self.stream.flush()
+
+class MetricsWriter:
+    """把每个文件的耗时、吞吐和重试次数写成 JSON Lines，便于接入日志系统"""
+    
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.file = open(path, "a", encoding="utf-8")
+    
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+    
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+def _format_bytes(amount):
+    """把字节数格式化为 KiB/MiB/GiB"""
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(amount) < 1024:
+            return f"{amount:.1f} {unit}"
+        amount /= 1024
+    return f"{amount:.1f} TiB"
+
+def _format_seconds(seconds):
+    """把秒数格式化为 HH:MM:SS"""
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+def _account_bytes(amount):
+    """每个数据块下载后调用：按全局令牌桶限速，并计入自适应控制器和汇总进度"""
+    if _rate_limiter is not None:
+        _rate_limiter.consume(amount)
+    if _controller is not None:
+        _controller.record_bytes(amount)
+    if _progress is not None:
+        _progress.advance(amount)
+
+def _expect_bytes(amount):
+    """开始传输、得知大小后调用，用于汇总进度的 ETA"""
+    if _progress is not None and amount > 0:
+        _progress.add_bytes(amount)
+
+def _report_file(category, title, url, started, transferred, ok, retries, error=None):
+    """一个文件结束（成功或失败）时更新汇总进度并输出指标"""
+    if _progress is not None:
+        _progress.file_done(ok)
+    if _metrics is not None:
+        seconds = time.monotonic() - started
+        _metrics.write({
+            "event": "file",
+            "time": time.time(),
+            "category": category,
+            "title": title,
+            "url": url,
+            "status": "done" if ok else "failed",
+            "bytes": transferred,
+            "seconds": round(seconds, 3),
+            "throughput": round(transferred / seconds) if seconds > 0 else None,
+            "retries": retries,
+            "error": error,
+        })
+
+class BlockWriter:
+    """大块写盘：数据先拷进可复用的 WRITE_BLOCK 缓冲区，攒满才写一次；
+    已知大小时用 posix_fallocate 预分配，减少 NAS 上的元数据更新和碎片。
+    预分配后文件长度不再等于已下载字节数，所以每写完一块就把已确认长度记到 length_path，
+    续传时以它为准（见 _resume_offset）"""
+    
+    def __init__(self, path, offset=0, size=0, truncate=True, length_path=None,
+                 block_size=None, fsync=None, progress=None):
+        self.path = path
+        self.length_path = length_path
+        self.progress = progress  # 每次写盘后以已写到的位置调用，分段下载用它记录进度
+        self.fsync = fsync or FSYNC_MODE
+        self.truncate = truncate
+        self.buffer = bytearray(block_size or WRITE_BLOCK)
+        self.view = memoryview(self.buffer)
+        self.filled = 0
+        self.position = offset
+        self.file = open(path, "r+b" if os.path.exists(path) else "w+b", buffering=0)
+        if truncate:
+            self.file.truncate(offset)
+        self.file.seek(offset)
+        if self.length_path:
+            self._save_length()
+        if truncate and size > offset:
+            preallocate(self.file, offset, size - offset)
+    
+    def write(self, data):
+        data = memoryview(data)
+        while len(data):
+            count = min(len(data), len(self.buffer) - self.filled)
+            self.view[self.filled:self.filled + count] = data[:count]
+            self.filled += count
+            data = data[count:]
+            if self.filled == len(self.buffer):
+                self.flush()
+    
+    def flush(self):
+        if self.filled:
+            view = self.view[:self.filled]
+            while len(view):
+                view = view[self.file.write(view):]
+            self.position += self.filled
+            self.filled = 0
+            if self.length_path:
+                self._save_length()
+            if self.progress:
+                self.progress(self.position)
+    
+    def close(self):
+        """写出剩余数据，裁掉预分配但未写入的部分，按 fsync 策略落盘"""
+        try:
+            self.flush()
+            if self.truncate:
+                self.file.truncate(self.position)
+            if self.fsync == "end":
+                os.fsync(self.file.fileno())
+        finally:
+            self.file.close()
+    
+    def _save_length(self):
+        _write_text_atomic(self.length_path, str(self.position))
+
+def preallocate(file, offset, length):
+    """为文件预留磁盘空间；不支持 posix_fallocate 的平台或文件系统上退回 truncate 扩展长度"""
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(file.fileno(), offset, length)
+            return
+        except OSError:
+            pass
+    end = file.tell()
+    file.truncate(offset + length)
+    file.seek(end)
+
+def _iter_blocks(response):
+    """逐块读取响应体：没有 Content-Encoding 时用 readinto 读进同一个大缓冲区，
+    产出的 memoryview 在下一次迭代前有效；有压缩编码时退回 iter_content"""
+    if response.headers.get("Content-Encoding", "identity").lower() != "identity":
+        yield from response.iter_content(chunk_size=READ_BUFFER)
+        return
+    buffer = bytearray(READ_BUFFER)
+    view = memoryview(buffer)
+    while True:
+        count = response.raw.readinto(buffer)
+        if not count:
+            break
+        yield view[:count]
+
+def _resume_offset(part_filename):
+    """返回 .part 可续传的字节数并裁掉其后的预分配/未确认数据，以 .length 记录为准；
+    .length 缺失或读不出时无法区分已下载数据和预分配的零，从头下载"""
+    size = _file_size(part_filename)
+    if not size:
+        return 0
+    try:
+        with open(part_filename + ".length", "r", encoding="utf-8") as f:
+            confirmed = min(int(f.read().strip()), size)
+    except (OSError, ValueError):
+        confirmed = 0
+    if confirmed < size:
+        os.truncate(part_filename, confirmed)
+    return confirmed
+
+def _retry_count(response):
+    """urllib3 为这次请求做过的重试次数"""
+    retries = getattr(response.raw, "retries", None)
+    return len(retries.history) if retries is not None else 0
+
+def parse_rate(text):
+    """解析带宽参数，支持 K/M/G 后缀（按 1024 进位），如 "20M" 表示 20 MiB/s"""
+    text = str(text).strip().upper().rstrip("B")
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(float(text or 0))
 
 def sanitize_filename(filename):
     """清理文件名，去除非法字符"""
     return re.sub(r'[^\w\-_\. ]', '_', filename)
 
-def download_video(category, title, url):
-    """下载单个视频，显示进度条，如果文件已存在则跳过"""
+def get_session():
+    """返回当前线程专用的 Session：长连接池大小与线程数一致，并带重试/退避，
+    避免每个请求都经代理重新做一次 TCP+TLS 握手"""
+    session = getattr(_thread_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        retry = Retry(
+            total=RETRIES,
+            backoff_factor=BACKOFF_FACTOR,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=("GET", "HEAD"),
+        )
+        adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS, max_retries=retry)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.proxies = {"http": PROXY, "https": PROXY}
+        _thread_local.session = session
+        with _sessions_lock:
+            _sessions.append(session)
+    return session
+
+def connection_stats():
+    """汇总所有会话的连接统计，返回 {"requests", "new_connections", "reused"}"""
+    total_requests = new_connections = 0
+    with _sessions_lock:
+        sessions = list(_sessions)
+    for session in sessions:
+        for adapter in set(session.adapters.values()):
+            managers = [adapter.poolmanager] + list(adapter.proxy_manager.values())
+            for manager in managers:
+                for key in list(manager.pools.keys()):
+                    pool = manager.pools.get(key)
+                    if pool is None:
+                        continue
+                    total_requests += pool.num_requests
+                    new_connections += pool.num_connections
+    return {
+        "requests": total_requests,
+        "new_connections": new_connections,
+        "reused": total_requests - new_connections,
+    }
+
+def _get_worker_executor():
+    """下载线程池，批量 HEAD 也在这里跑：排序、去重时 HEAD 建立的长连接留在这些线程的 Session 里，
+    随后提交的下载直接复用，不必再握手一次。main 结束时关闭"""
+    global _worker_executor
+    with _worker_executor_lock:
+        if _worker_executor is None:
+            _worker_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=MAX_WORKERS, thread_name_prefix="worker")
+        return _worker_executor
+
+def _get_segment_executor():
+    """分段下载共用的常驻线程池，线程常驻才能复用各自的 Session 连接"""
+    global _segment_executor
+    with _segment_executor_lock:
+        if _segment_executor is None:
+            _segment_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=MAX_WORKERS * SEGMENTS, thread_name_prefix="segment")
+        return _segment_executor
+
+def video_path(category, title, locale=None):
+    """返回视频的保存路径 DOWNLOAD_DIR/[语言/]类别/标题.mp4，并确保类别目录存在"""
     sanitized_category = sanitize_filename(category)
     sanitized_title = sanitize_filename(title)
-    category_dir = os.path.join(DOWNLOAD_DIR, sanitized_category)
+    base_dir = os.path.join(DOWNLOAD_DIR, sanitize_filename(locale)) if locale else DOWNLOAD_DIR
+    category_dir = os.path.join(base_dir, sanitized_category)
     os.makedirs(category_dir, exist_ok=True)
-    filename = os.path.join(category_dir, f"{sanitized_title}.mp4")
+    return os.path.join(category_dir, f"{sanitized_title}.mp4")
+
+def download_video(category, title, url, locale=None):
+    """下载单个视频并计入汇总进度；先写入 .part 临时文件，中断后可按 Range 断点续传，
+    下载完整后才重命名为最终文件，因此已存在的 .mp4 一定是完整文件。
+    读响应体时连接断开不算失败，在本次调用内退避后续传，最多重试 RETRIES 次"""
+    filename = video_path(category, title, locale)
+    job_category = _ledger_category(category, locale)
+    part_filename = filename + PART_SUFFIX
     
     if os.path.exists(filename):
         print(f"{title} 已存在，跳过下载")
-        return
+        _record(job_category, title, url, status="done", bytes_done=os.path.getsize(filename))
+        # main 已把它计入总数，跳过也要记为完成
+        _report_file(job_category, title, url, time.monotonic(), 0, True, 0)
+        return True
     
+    _record(job_category, title, url, status="running", error=None)
+    started = time.monotonic()
+    transferred = retries = 0
     try:
-        # 设置代理
-        proxies = {"http": PROXY, "https": PROXY}
-        response = requests.get(url, stream=True, proxies=proxies)
-        response.raise_for_status()
-        
-        # 获取文件总大小
-        total_size = int(response.headers.get('content-length', 0))
+        # 大文件且服务器支持 Range 时多连接分段下载；已有 .part 时仍走单连接续传
+        if SEGMENTS > 1 and not os.path.exists(part_filename):
+            total_size, etag, modified, ranges = _head(url)
+            # 没有可用的校验值时仍分段下载，只是各分段不带 If-Range，中断后也不续传分段
+            validator = _range_validator(etag, modified)
+            if ranges and total_size >= SEGMENT_MIN_SIZE:
+                seg_filename = filename + SEGMENT_SUFFIX
+                try:
+                    retries, transferred, sha256 = download_segmented(url, seg_filename, total_size, validator)
+                except RemoteChangedError as e:
+                    # 远端文件变了或服务器不肯按 Range 返回：分段临时文件已删除，本次改用单连接下载
+                    print(f"{category}/{title} 分段下载失败（{e}），改用单连接下载")
+                else:
+                    _finish_download(job_category, title, url, seg_filename, filename, sha256, total_size,
+                                     etag=etag)
+                    _remove_quietly(seg_filename + SEGMENT_STATE_SUFFIX)
+                    _report_file(job_category, title, url, started, transferred, True, retries)
+                    print(f"已下载: {category}/{title}")
+                    return True
         
-        # 使用 tqdm 显示下载进度条
-        with open(filename, "wb") as f, tqdm(
-            desc=f"{category}/{title}",
-            total=total_size,
-            unit='B',
-            unit_scale=True,
-            unit_divisor=1024,
-        ) as pbar:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-                pbar.update(len(chunk))
+        # 这次不分段（HEAD 失败、文件变小或改回单连接）：之前分段下载留下的临时文件不会再用
+        _discard_segments(filename)
+        attempts = 0
+        while True:
+            try:
+                sent, attempt_retries = _transfer(job_category, title, url, filename)
+                transferred += sent
+                retries += attempt_retries
+                break
+            except _TRANSIENT_ERRORS:
+                # 读响应体时连接断开：urllib3 的 Retry 管不到，退避后从 .part 已确认的偏移续传
+                if attempts >= RETRIES:
+                    raise
+                time.sleep(BACKOFF_FACTOR * 2 ** attempts)
+                attempts += 1
+                retries += 1
+        _report_file(job_category, title, url, started, transferred, True, retries)
         print(f"已下载: {category}/{title}")
+        return True
     except Exception as e:
         print(f"下载失败 {category}/{title}: {e}")
+        _record(job_category, title, url, status="failed", error=str(e),
+                bytes_done=_confirmed_bytes(filename))
+        _report_file(job_category, title, url, started, transferred, False, retries, str(e))
+        return False
+
+def _transfer(job_category, title, url, filename):
+    """download_video 单连接下载的一次尝试：从 .part 已确认的偏移续传到完成并改名，
+    返回 (本次传输的字节数, urllib3 为本次请求做过的重试次数)。读到一半连接断开时抛出 _TRANSIENT_ERRORS 中的异常，
+    已写入的数据和 .length 记录保留，下一次尝试接着续传"""
+    part_filename = filename + PART_SUFFIX
+    etag_filename = part_filename + ".etag"
+    length_filename = part_filename + ".length"
+    transferred = 0
+    # 已有部分数据时，从已确认的偏移续传；用 If-Range 校验远端文件未变化
+    offset = _resume_offset(part_filename)
+    headers = {}
+    if offset > 0:
+        headers["Range"] = f"bytes={offset}-"
+        validator = _read_validator(etag_filename)
+        if validator:
+            headers["If-Range"] = validator
+    
+    response = get_session().get(url, stream=True, headers=headers)
+    if response.status_code == 416:
+        # 请求范围越界：.part 已经是完整文件（或远端变小了），交由长度校验处理
+        response.close()
+        if _finish_complete_part(job_category, title, url, filename, offset):
+            return 0, 0
+        offset = 0
+        response = get_session().get(url, stream=True)
+    response.raise_for_status()
+    retries = _retry_count(response)
+    
+    if response.status_code != 206:
+        # 服务器不支持 Range 或 If-Range 校验失败（文件已变化），从头下载
+        offset = 0
+    
+    _save_validator(etag_filename, response.headers)
+    
+    # 获取文件总大小（续传时 content-length 只是剩余部分）
+    total_size = offset + int(response.headers.get('content-length', 0))
+    _record(job_category, title, url, status="running", bytes_done=offset,
+            size=total_size or None, etag=response.headers.get("ETag"))
+    
+    # 边下载边计算 sha256；续传时先补算已有部分
+    hasher = hashlib.sha256()
+    if offset:
+        _hash_file(part_filename, hasher)
+    
+    _expect_bytes(total_size - offset)
+    writer = BlockWriter(part_filename, offset, total_size, length_path=length_filename)
+    try:
+        for block in _iter_blocks(response):
+            writer.write(block)
+            hasher.update(block)
+            transferred += len(block)
+            _account_bytes(len(block))
+    finally:
+        writer.close()
+    
+    written = os.path.getsize(part_filename)
+    if total_size > offset and written != total_size:
+        raise TruncatedError(f"文件不完整：已写入 {written} 字节，应为 {total_size} 字节")
+    _finish_download(job_category, title, url, part_filename, filename, hasher.hexdigest(), written)
+    return transferred, retries
+
+def download_video_adaptive(category, title, url, locale=None):
+    """在自适应控制器分配的名额内运行 download_video"""
+    _controller.acquire()
+    ok = False
+    try:
+        ok = download_video(category, title, url, locale)
+    finally:
+        _controller.release(ok)
+
+class RemoteChangedError(IOError):
+    """续传或分段请求时远端文件已变化（If-Range 校验失败），已下载的部分不能再用"""
+
+class TruncatedError(IOError):
+    """响应体比声明的短（连接提前关闭），已写入的部分可用，可以续传重试"""
+
+# 读响应体时连接断开等可以从已写到的位置续传重试的错误；urllib3 的 Retry 只管建连和响应头，不管读响应体
+_TRANSIENT_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                     ProtocolError, ReadTimeoutError, TruncatedError)
+
+class SegmentState:
+    """分段下载的进度记录（.seg.state）：文件大小、ETag/Last-Modified 和各分段 [已写到的位置, 结束位置]。
+    每个分段每写一块就原子重写一次，进程中断后下次运行只补下各分段剩下的部分"""
+    
+    def __init__(self, path, size, validator, segments):
+        self.path = path
+        self.size = size
+        self.validator = validator
+        self.segments = segments
+        self.lock = threading.Lock()
+    
+    @classmethod
+    def load(cls, path, size, validator):
+        """读取进度记录；不存在、损坏或与远端文件（大小、校验值）对不上时返回 None"""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            segments = [[int(position), int(end)] for position, end in data["segments"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        if data.get("size") != size or not validator or data.get("validator") != validator:
+            return None
+        return cls(path, size, validator, segments)
+    
+    def update(self, index, position):
+        with self.lock:
+            self.segments[index][0] = position
+            self.save()
+    
+    def save(self):
+        _write_text_atomic(self.path, json.dumps(
+            {"size": self.size, "validator": self.validator, "segments": self.segments}))
+    
+    def remaining(self):
+        return sum(max(0, end + 1 - position) for position, end in self.segments)
+    
+    def contiguous(self):
+        """文件开头已连续写好的字节数，即第一个未完成分段已写到的位置"""
+        with self.lock:
+            for position, end in self.segments:
+                if position <= end:
+                    return position
+        return self.size
+
+class PrefixHasher:
+    """分段下载的增量 sha256：每个分段写盘后调用 advance，把文件开头已连续写好、还没算过的部分读回来。
+    刚写的数据通常还在页缓存里，读回与下载同时进行，下载完成时只剩最后补上的一小段"""
+    
+    def __init__(self, path, state):
+        self.path = path
+        self.state = state
+        self.hasher = hashlib.sha256()
+        self.position = 0
+        self.buffer = bytearray(READ_BUFFER)
+        self.lock = threading.Lock()
+    
+    def advance(self, wait=False):
+        """哈希到当前连续前缀的末尾；其他线程正在哈希时直接返回（wait 为真时等它），由它或下一次调用接着算"""
+        if not self.lock.acquire(blocking=wait):
+            return
+        try:
+            end = self.state.contiguous()
+            if end <= self.position:
+                return
+            view = memoryview(self.buffer)
+            with open(self.path, "rb", buffering=0) as f:
+                f.seek(self.position)
+                while self.position < end:
+                    count = f.readinto(view[:min(len(view), end - self.position)])
+                    if not count:
+                        break
+                    self.hasher.update(view[:count])
+                    self.position += count
+        finally:
+            self.lock.release()
+    
+    def hexdigest(self):
+        self.advance(wait=True)
+        return self.hasher.hexdigest()
+
+def download_segmented(url, seg_filename, total_size, validator, segments=None):
+    """把文件切成若干字节区间并发下载，写入预分配文件的对应偏移，最后校验总长度，
+    返回 (各分段请求的重试次数之和, 本次传输的字节数, sha256)。各分段的进度记在 .seg.state 中：中断或失败后保留临时文件，
+    下次运行时若远端文件未变化，只补下各分段剩下的部分。分段读到一半连接断开时在本分段内退避续传，
+    重试用完仍失败才取消其余分段。
+    sha256 由 PrefixHasher 随文件开头的连续部分增长边下边算，不必在完成后再整个读一遍"""
+    segments = segments or SEGMENTS
+    state_filename = seg_filename + SEGMENT_STATE_SUFFIX
+    state = SegmentState.load(state_filename, total_size, validator) if os.path.exists(seg_filename) else None
+    if state is None:
+        # 预分配文件，各分段直接写到自己的偏移处
+        with open(seg_filename, "wb") as f:
+            preallocate(f, 0, total_size)
+        segment_size = -(-total_size // segments)
+        state = SegmentState(state_filename, total_size, validator,
+                             [[start, min(start + segment_size, total_size) - 1]
+                              for start in range(0, total_size, segment_size)])
+        state.save()
+    elif state.remaining() < total_size:
+        print(f"续传分段下载，剩余 {_format_bytes(state.remaining())}")
+    remaining = state.remaining()
+    _expect_bytes(remaining)
+    stop = threading.Event()
+    hasher = PrefixHasher(seg_filename, state)
+    
+    def saved(index, position):
+        state.update(index, position)
+        hasher.advance()
+    
+    def fetch(index):
+        """下载一个分段；读响应体时连接断开则退避后从该分段已写到的位置续传，最多重试 RETRIES 次"""
+        attempts = 0
+        while True:
+            try:
+                return attempts + fetch_once(index)
+            except _TRANSIENT_ERRORS:
+                if attempts >= RETRIES or stop.wait(BACKOFF_FACTOR * 2 ** attempts):
+                    raise
+                attempts += 1
+    
+    def fetch_once(index):
+        start, end = state.segments[index]
+        if start > end:
+            return 0
+        headers = {"Range": f"bytes={start}-{end}"}
+        if validator:
+            headers["If-Range"] = validator
+        response = get_session().get(url, stream=True, headers=headers)
+        response.raise_for_status()
+        if response.status_code != 206:
+            # If-Range 校验失败（文件已变化）或服务器忽略了 Range
+            response.close()
+            raise RemoteChangedError(f"分段 {start}-{end} 未返回 206 分段内容")
+        position = start
+        # 各分段只负责写，整个文件下载完再统一 fsync
+        writer = BlockWriter(seg_filename, start, truncate=False, fsync="none",
+                             progress=lambda written: saved(index, written))
+        try:
+            for block in _iter_blocks(response):
+                if stop.is_set():
+                    response.close()
+                    raise IOError(f"分段 {start}-{end} 已取消")
+                writer.write(block)
+                position += len(block)
+                _account_bytes(len(block))
+        finally:
+            writer.close()
+        if position != end + 1:
+            raise TruncatedError(f"分段 {start}-{end} 不完整：只收到 {position - start} 字节")
+        return _retry_count(response)
+    
+    futures = [_get_segment_executor().submit(fetch, index) for index in range(len(state.segments))]
+    try:
+        retries = sum(future.result() for future in concurrent.futures.as_completed(futures))
+    except Exception as e:
+        # 取消还没开始的分段，通知正在下载的分段停下，等它们都退出后再返回，
+        # 免得它们在本函数返回后还往临时文件里写
+        stop.set()
+        for future in futures:
+            future.cancel()
+        concurrent.futures.wait(futures)
+        if isinstance(e, RemoteChangedError):
+            _remove_quietly(seg_filename)
+            _remove_quietly(state_filename)
+        raise
+    written = os.path.getsize(seg_filename)
+    if written != total_size:
+        _remove_quietly(seg_filename)
+        _remove_quietly(state_filename)
+        raise IOError(f"文件长度不符：{written} 字节，应为 {total_size} 字节")
+    if FSYNC_MODE == "end":
+        _fsync_file(seg_filename)
+    return retries, remaining, hasher.hexdigest()
+
+def _head(url):
+    """HEAD 探测远端文件，返回 (大小, ETag, Last-Modified, 是否支持 Range)，失败时大小为 0；
+    结果缓存在 _head_cache 中"""
+    result = _head_cache.get(url)
+    if result is not None:
+        return result
+    try:
+        response = get_session().head(url, allow_redirects=True)
+        response.raise_for_status()
+    except Exception:
+        result = 0, None, None, False
+    else:
+        headers = response.headers
+        result = (int(headers.get('content-length', 0)), headers.get("ETag"), headers.get("Last-Modified"),
+                  headers.get("Accept-Ranges", "").lower() == "bytes")
+    _head_cache[url] = result
+    return result
+
+def _range_validator(etag, modified):
+    """选出可用于 If-Range 的校验值：只有强 ETag 可以，弱 ETag（W/"…"）按 RFC 9110 不能用于
+    If-Range，服务器会回 200 整个文件，此时退回 Last-Modified；都没有时返回 None"""
+    if etag and not etag.startswith("W/"):
+        return etag
+    return modified or None
+
+def _save_validator(etag_filename, headers):
+    """把响应的 If-Range 校验值记到 .etag 供下次续传；没有可用的校验值时删掉旧记录，免得下次沿用"""
+    validator = _range_validator(headers.get("ETag"), headers.get("Last-Modified"))
+    if validator:
+        _write_text_atomic(etag_filename, validator)
+    else:
+        _remove_quietly(etag_filename)
+
+def _read_validator(etag_filename):
+    """读取上次下载记录的 ETag / Last-Modified，用于 If-Range 校验；旧版本记下的弱 ETag 视为没有"""
+    try:
+        with open(etag_filename, "r", encoding="utf-8") as f:
+            return _range_validator(f.read().strip(), None)
+    except OSError:
+        return None
+
+def read_manifest(directory):
+    """读取类别目录下的清单 {文件名: {"sha256", "size"}}，不存在时返回空字典"""
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_manifest(filename, sha256, size):
+    """把下载完成的文件登记到所在类别目录的清单中（原子替换写入）"""
+    directory = os.path.dirname(filename)
+    manifest_path = os.path.join(directory, MANIFEST_FILE)
+    with _manifest_lock:
+        manifest = read_manifest(directory)
+        manifest[os.path.basename(filename)] = {"sha256": sha256, "size": size}
+        temp_path = manifest_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(temp_path, manifest_path)
+
+def verify_file(job):
+    """校验单个文件，供进程池调用：先比大小，再用大块缓冲读取计算 sha256。
+    返回 (路径, 错误信息)，通过时错误信息为 None"""
+    path, size, sha256 = job
+    try:
+        actual_size = os.path.getsize(path)
+        if actual_size != size:
+            return path, f"大小不符：{actual_size} 字节，清单记录 {size} 字节"
+        hasher = hashlib.sha256()
+        buffer = bytearray(VERIFY_BUFFER)
+        view = memoryview(buffer)
+        with open(path, "rb", buffering=0) as f:
+            while True:
+                count = f.readinto(buffer)
+                if not count:
+                    break
+                hasher.update(view[:count])
+        if hasher.hexdigest() != sha256:
+            return path, "sha256 不符"
+        return path, None
+    except OSError as e:
+        return path, f"无法读取：{e}"
+
+def verify_tree(root, workers=None):
+    """并行校验 root 下所有清单登记的文件，并报告未登记的 mp4；返回问题数量"""
+    jobs = []
+    unlisted = []
+    for directory, _, files in os.walk(root):
+        manifest = read_manifest(directory)
+        for name, entry in manifest.items():
+            jobs.append((os.path.join(directory, name), entry["size"], entry["sha256"]))
+        unlisted.extend(os.path.join(directory, name) for name in files
+                        if name.endswith(".mp4") and name not in manifest)
+    
+    # 按大小从大到小分发，避免最后剩一个大文件拖尾
+    jobs.sort(key=lambda job: job[1], reverse=True)
+    problems = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        for path, error in executor.map(verify_file, jobs, chunksize=4):
+            if error:
+                problems += 1
+                print(f"校验失败 {path}: {error}")
+    if problems:
+        print("台账仍把校验失败的文件记为已完成：删掉这些文件后用 --no-ledger 运行一次即可重新下载")
+    for path in unlisted:
+        problems += 1
+        print(f"未登记 {path}: 清单中没有该文件")
+    print(f"共校验 {len(jobs)} 个文件，发现 {problems} 个问题")
+    return problems
 
-def main():
+def _hash_file(path, hasher):
+    """把文件内容喂给 hasher 并返回它"""
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(block)
+    return hasher
+
+def _write_text_atomic(path, text):
+    """先写临时文件再替换，中途崩溃时原文件要么是旧内容要么是新内容，不会被截成空文件"""
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+def _fsync_file(path):
+    """把文件已写入的内容刷到磁盘"""
+    with open(path, "rb+") as f:
+        os.fsync(f.fileno())
+
+def _file_size(path):
+    """返回文件大小，不存在时为 0"""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def _remove_quietly(path):
+    """删除文件，不存在时忽略"""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def _confirmed_bytes(filename):
+    """已确认下载的字节数，失败时记进台账：分段下载按 .seg.state 中各分段已写到的位置算，
+    单连接下载取 .part 的大小"""
+    state_filename = filename + SEGMENT_SUFFIX + SEGMENT_STATE_SUFFIX
+    try:
+        with open(state_filename, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        state = SegmentState(state_filename, int(data["size"]), None,
+                             [[int(position), int(end)] for position, end in data["segments"]])
+    except (OSError, ValueError, KeyError, TypeError):
+        return _file_size(filename + PART_SUFFIX)
+    return state.size - state.remaining()
+
+def _discard_segments(filename):
+    """删掉分段下载留下的 .seg 和 .seg.state；单连接下载时调用，免得几 GB 的临时文件一直留在镜像里"""
+    seg_filename = filename + SEGMENT_SUFFIX
+    _remove_quietly(seg_filename)
+    _remove_quietly(seg_filename + SEGMENT_STATE_SUFFIX)
+
+def _finish_download(job_category, title, url, temp_filename, filename, sha256, size, **fields):
+    """临时文件已下载完整：改名为最终文件，清掉续传记录，登记清单和台账"""
+    os.replace(temp_filename, filename)
+    _remove_quietly(temp_filename + ".etag")
+    _remove_quietly(temp_filename + ".length")
+    write_manifest(filename, sha256, size)
+    _record(job_category, title, url, status="done", bytes_done=size, size=size, sha256=sha256, **fields)
+
+def _finish_complete_part(job_category, title, url, filename, offset):
+    """续传请求回 416 时调用：.part 已与远端文件等长说明上次其实下完了，
+    补算 sha256 后直接完成并返回 True；长度对不上返回 False，由调用方从头下载"""
+    part_filename = filename + PART_SUFFIX
+    total_size = _head(url)[0]
+    if not total_size or offset != total_size:
+        return False
+    sha256 = _hash_file(part_filename, hashlib.sha256()).hexdigest()
+    _finish_download(job_category, title, url, part_filename, filename, sha256, total_size)
+    return True
+
+async def download_video_async(session, semaphore, category, title, url, locale=None):
+    """asyncio 版本的 download_video：同样的目录结构和 .part 断点续传，
+    数据攒到 ASYNC_WRITE_BUFFER 后用异步文件写入；连接错误和 429/5xx 最多重试 RETRIES 次"""
+    filename = video_path(category, title, locale)
+    job_category = _ledger_category(category, locale)
+    part_filename = filename + PART_SUFFIX
+    
+    if os.path.exists(filename):
+        print(f"{title} 已存在，跳过下载")
+        await asyncio.to_thread(_record, job_category, title, url, status="done",
+                                bytes_done=os.path.getsize(filename))
+        # main 已把它计入总数，跳过也要记为完成
+        _report_file(job_category, title, url, time.monotonic(), 0, True, 0)
+        return
+    
+    async with semaphore:
+        await asyncio.to_thread(_record, job_category, title, url, status="running", error=None)
+        started = time.monotonic()
+        transferred = retries = 0
+        try:
+            while True:
+                try:
+                    transferred += await _transfer_async(session, job_category, title, url, filename)
+                    break
+                except Exception as e:
+                    # 与 thread 引擎的 urllib3 Retry 一致：连接错误和 429/5xx 退避后重试，从已确认的偏移续传
+                    if retries >= RETRIES or not _retryable_async(e):
+                        raise
+                    await asyncio.sleep(BACKOFF_FACTOR * 2 ** retries)
+                    retries += 1
+            _report_file(job_category, title, url, started, transferred, True, retries)
+            print(f"已下载: {category}/{title}")
+        except Exception as e:
+            print(f"下载失败 {category}/{title}: {e}")
+            await asyncio.to_thread(_record, job_category, title, url, status="failed", error=str(e),
+                                    bytes_done=_file_size(part_filename))
+            _report_file(job_category, title, url, started, transferred, False, retries, str(e))
+
+def _retryable_async(error):
+    """aiohttp 的连接错误、超时和 429/5xx 响应可以重试，其他错误（如 404）直接失败"""
+    import aiohttp
+    
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status in RETRY_STATUSES
+    return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError))
+
+async def _transfer_async(session, job_category, title, url, filename):
+    """download_video_async 的一次尝试：从 .part 已确认的偏移续传到完成并改名，返回本次传输的字节数。
+    中途失败时已写入的数据和 .length 记录保留，下一次尝试接着续传。
+    续传记录、清单和台账的同步读写都放到线程里，免得几百个并发传输时卡住事件循环"""
+    import aiofiles
+    
+    part_filename = filename + PART_SUFFIX
+    etag_filename = part_filename + ".etag"
+    length_filename = part_filename + ".length"
+    transferred = 0
+    # async 引擎不分段，thread 引擎留下的分段临时文件不会再用
+    await asyncio.to_thread(_discard_segments, filename)
+    offset = await asyncio.to_thread(_resume_offset, part_filename)
+    headers = {}
+    if offset > 0:
+        headers["Range"] = f"bytes={offset}-"
+        validator = await asyncio.to_thread(_read_validator, etag_filename)
+        if validator:
+            headers["If-Range"] = validator
+    
+    response = await session.get(url, headers=headers, proxy=PROXY)
+    if response.status == 416:
+        # 请求范围越界：与 thread 引擎相同，.part 已完整就直接完成，否则从头下载
+        response.release()
+        if await asyncio.to_thread(_finish_complete_part, job_category, title, url, filename, offset):
+            return 0
+        offset = 0
+        response = await session.get(url, proxy=PROXY)
+    async with response:
+        response.raise_for_status()
+        if response.status != 206:
+            offset = 0
+        
+        await asyncio.to_thread(_save_validator, etag_filename, response.headers)
+        total_size = offset + int(response.headers.get('content-length', 0))
+        await asyncio.to_thread(_record, job_category, title, url, status="running", bytes_done=offset,
+                                size=total_size or None, etag=response.headers.get("ETag"))
+        
+        hasher = hashlib.sha256()
+        if offset:
+            # 补算已有部分的 sha256 可能要读几百 MB，放到线程里免得卡住事件循环
+            await asyncio.to_thread(_hash_file, part_filename, hasher)
+        _expect_bytes(total_size - offset)
+        buffer = bytearray()
+        position = offset
+        await asyncio.to_thread(_write_text_atomic, length_filename, str(position))
+        async with aiofiles.open(part_filename, "ab" if offset else "wb") as f:
+            async for chunk in response.content.iter_chunked(65536):
+                buffer += chunk
+                hasher.update(chunk)
+                transferred += len(chunk)
+                if _progress is not None:
+                    _progress.advance(len(chunk))
+                if _rate_limiter is not None:
+                    await asyncio.sleep(_rate_limiter.reserve(len(chunk)))
+                if len(buffer) >= ASYNC_WRITE_BUFFER:
+                    await f.write(bytes(buffer))
+                    await f.flush()
+                    position += len(buffer)
+                    await asyncio.to_thread(_write_text_atomic, length_filename, str(position))
+                    buffer.clear()
+            if buffer:
+                await f.write(bytes(buffer))
+    
+    written = await asyncio.to_thread(os.path.getsize, part_filename)
+    if total_size > offset and written != total_size:
+        raise IOError(f"文件不完整：已写入 {written} 字节，应为 {total_size} 字节")
+    if FSYNC_MODE == "end":
+        # 改名后 .mp4 就被当作完整文件，改名前必须已经落盘
+        await asyncio.to_thread(_fsync_file, part_filename)
+    # 改名并重写整个类别清单、提交台账
+    await asyncio.to_thread(_finish_download, job_category, title, url, part_filename, filename,
+                            hasher.hexdigest(), written)
+    return transferred
+
+async def download_all_async(items, concurrency=None):
+    """用 aiohttp 并发下载 (类别, 标题, URL[, 语言]) 列表，信号量限制同时进行的传输数"""
+    import aiohttp
+    
+    concurrency = concurrency or ASYNC_CONCURRENCY
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=concurrency)
+    # 大文件下载不设总超时，只限制单次读取的等待时间
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=60)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        await asyncio.gather(*(
+            download_video_async(session, semaphore, *item)
+            for item in items
+        ))
+
+class CatalogParser(HTMLParser):
+    """增量解析下载页面：每读完一个 intl-downloads-item 块就产出一条 (类别, 标题, URL)，
+    不构建整棵 DOM 树，内存占用与页面大小无关"""
+    
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.div_stack = []  # 每个未闭合 div 的 class 集合
+        self.category = None  # 当前类别标题的文字片段；None 表示不在类别组中
+        self.item = None  # 当前视频项 {"title": [...], "href": ...}
+        self.text_target = None  # 正在收集文字的列表（类别标题或视频标题）
+        self.ready = []
+    
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            # 与原先 item.find("a") 一致：只看视频项中的第一个 <a>
+            if self.item is not None and not self.item["seen_a"]:
+                self.item["seen_a"] = True
+                self.item["href"] = dict(attrs).get("href")
+            return
+        if tag != "div":
+            return
+        classes = set((dict(attrs).get("class") or "").split())
+        self.div_stack.append(classes)
+        if "intl-downloads-group" in classes:
+            self.category = []
+        elif "intl-downloads-group-title" in classes and self.category is not None and self.item is None:
+            self.text_target = self.category
+        elif "intl-downloads-item" in classes:
+            self.item = {"title": None, "href": None, "seen_a": False}
+        elif "intl-downloads-item-title" in classes and self.item is not None and self.item["title"] is None:
+            self.item["title"] = []
+            self.text_target = self.item["title"]
+    
+    def handle_endtag(self, tag):
+        if tag != "div" or not self.div_stack:
+            return
+        classes = self.div_stack.pop()
+        if "intl-downloads-group-title" in classes or "intl-downloads-item-title" in classes:
+            self.text_target = None
+        elif "intl-downloads-item" in classes and self.item is not None:
+            self._finish_item()
+        elif "intl-downloads-group" in classes:
+            self.category = None
+    
+    def handle_data(self, data):
+        if self.text_target is not None:
+            self.text_target.append(data)
+    
+    def _finish_item(self):
+        category_title = "".join(self.category or []).strip() or "未知类别"
+        title = "".join(self.item["title"] or []).strip() or "未知标题"
+        href = self.item["href"]
+        self.item = None
+        if self.category is None:
+            return
+        if href:
+            self.ready.append((category_title, title, href))
+        else:
+            print(f"未找到 {category_title}/{title} 的下载链接")
+    
+    def drain(self):
+        """取出目前已解析完成的条目"""
+        ready, self.ready = self.ready, []
+        return ready
+
+def iter_catalog(response):
+    """边接收下载页面边解析，逐条产出 (类别, 标题, URL)"""
+    # 响应头没有声明 charset 时 requests 会默认 ISO-8859-1，这里按 UTF-8 处理
+    content_type = response.headers.get("Content-Type", "")
+    encoding = response.encoding if "charset" in content_type.lower() else "utf-8"
+    decoder = codecs.getincrementaldecoder(encoding or "utf-8")(errors="replace")
+    parser = CatalogParser()
+    for chunk in response.iter_content(chunk_size=65536):
+        parser.feed(decoder.decode(chunk))
+        yield from parser.drain()
+    parser.feed(decoder.decode(b"", final=True))
+    parser.close()
+    yield from parser.drain()
+
+def fetch_locale_catalogs(locales):
+    """并发抓取并解析多个语言的下载页面，返回 ((类别, 标题, URL, 语言) 列表, 是否有页面变化)"""
+    def fetch(locale):
+        items, changed = fetch_catalog(LOCALE_URL.format(locale=locale))
+        return [(*item, locale) for item in items], changed
+    
+    catalog = []
+    any_changed = False
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(locales), MAX_WORKERS)) as executor:
+        futures = {executor.submit(fetch, locale): locale for locale in locales}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                items, changed = future.result()
+            except Exception as e:
+                print(f"获取 {futures[future]} 下载页面失败: {e}")
+                any_changed = True
+                continue
+            catalog.extend(items)
+            any_changed = any_changed or changed
+    return catalog, any_changed
+
+def head_many(urls):
+    """在下载线程池中用各线程的长连接并发 _head，返回 {URL: (大小, ETag, Last-Modified, 是否支持 Range)}"""
+    missing = [url for url in dict.fromkeys(urls) if url not in _head_cache]
+    if missing:
+        list(_get_worker_executor().map(_head, missing))
+    return {url: _head_cache[url] for url in urls}
+
+def order_catalog(catalog, policy):
+    """按调度策略排列下载顺序（线程池和信号量都按提交顺序放行）：
+    shortest 小文件优先；largest 大文件优先（适合分段下载）；
+    round-robin 各类别轮流各取一个，按大小从小到大；page 保持页面顺序"""
+    if policy == "page":
+        return list(catalog)
+    catalog = list(catalog)
+    sizes = head_many([item[2] for item in catalog])
+    # 大小未知的排在同策略的最后
+    def size_key(item):
+        size = sizes[item[2]][0]
+        return size if size else float("inf")
+    
+    if policy == "shortest":
+        return sorted(catalog, key=size_key)
+    if policy == "largest":
+        return sorted(catalog, key=lambda item: -sizes[item[2]][0])
+    
+    groups = {}
+    for item in sorted(catalog, key=size_key):
+        groups.setdefault(_ledger_category(item[0], *item[3:]), []).append(item)
+    ordered = []
+    queues = list(groups.values())
+    for index in range(max((len(queue) for queue in queues), default=0)):
+        ordered.extend(queue[index] for queue in queues if index < len(queue))
+    return ordered
+
+def plan_dedup(catalog, known=None):
+    """找出内容相同的条目：先按 URL 归并，再对剩下的 URL 并发 HEAD，
+    Content-Length 和强 ETag 都相同的视为同一文件。每组优先保留磁盘上已有的条目，
+    给已有镜像新增语言时新条目直接链接到旧文件。
+    known 为台账中已完成条目的 {条目: (大小, ETag)}：这些条目视为已在磁盘上，直接用记录的大小和 ETag，
+    只 stat 和 HEAD 其余条目。
+    返回 (需要下载的条目列表, {重复条目: 对应的已下载条目})"""
+    known = known or {}
+    on_disk = set(known) | {item for item in catalog
+                            if item not in known and os.path.exists(video_path(item[0], item[1], *item[3:]))}
+    duplicates = {}
+    
+    def claim(groups, key, item):
+        primary = groups.setdefault(key, item)
+        if primary is item:
+            return
+        if primary not in on_disk and item in on_disk:
+            groups[key] = item
+            primary, item = item, primary
+        duplicates[item] = primary
+    
+    by_url = {}
+    for item in catalog:
+        claim(by_url, item[2], item)
+    
+    heads = head_many([url for url, item in by_url.items() if item not in known])
+    by_content = {}
+    for url, item in by_url.items():
+        if item in known:
+            size, etag = known[item]
+            # 旧版台账的 etag 列可能记的是 Last-Modified，只认带引号的强 ETag
+            if not (etag or "").startswith('"'):
+                continue
+        else:
+            size, etag = heads[url][:2]
+        if not etag or etag.startswith("W/") or not size:
+            continue
+        claim(by_content, (size, etag), item)
+    
+    # 指向的条目本身也可能是重复项，追溯到真正要下载的那一个
+    for item, primary in duplicates.items():
+        while primary in duplicates:
+            primary = duplicates[primary]
+        duplicates[item] = primary
+    unique = [item for item in catalog if item not in duplicates]
+    return unique, duplicates
+
+def link_duplicates(duplicates):
+    """把已下载的文件硬链接到重复条目的位置；跨文件系统等无法硬链接时退回复制。
+    每个重复条目也计入汇总进度"""
+    if _progress is not None:
+        _progress.add_files(len(duplicates))
+    for item, primary in duplicates.items():
+        source = video_path(primary[0], primary[1], *primary[3:])
+        target = video_path(item[0], item[1], *item[3:])
+        job_category = _ledger_category(item[0], *item[3:])
+        started = time.monotonic()
+        if os.path.exists(target):
+            _report_file(job_category, item[1], item[2], started, 0, True, 0)
+            continue
+        if not os.path.exists(source):
+            print(f"{job_category}/{item[1]} 的源文件未下载完成，跳过链接")
+            _report_file(job_category, item[1], item[2], started, 0, False, 0, "源文件未下载完成")
+            continue
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copy2(source, target)
+        entry = read_manifest(os.path.dirname(source)).get(os.path.basename(source))
+        if entry:
+            write_manifest(target, entry["sha256"], entry["size"])
+        _record(job_category, item[1], item[2], status="done", bytes_done=os.path.getsize(target))
+        _report_file(job_category, item[1], item[2], started, 0, True, 0)
+        print(f"已链接: {job_category}/{item[1]} -> {_ledger_category(primary[0], *primary[3:])}/{primary[1]}")
+
+def parse_args(argv=None):
+    """解析命令行参数，未指定的沿用文件顶部的配置"""
+    parser = argparse.ArgumentParser(description="BibleProject 视频批量下载")
+    parser.add_argument("--url", default=URL, help="下载页面地址")
+    parser.add_argument("--locales", default="",
+                        help="逗号分隔的语言列表（如 zhs,zht,eng），并发抓取各语言页面并去重；"
+                             "指定后忽略 --url，视频存放在 下载目录/语言/类别 下")
+    parser.add_argument("--dir", default=DOWNLOAD_DIR, help="下载目录")
+    parser.add_argument("--proxy", default=PROXY, help="代理地址，传空字符串表示不用代理")
+    parser.add_argument("--engine", choices=("thread", "async"), default="thread",
+                        help="下载引擎：thread 为线程池，async 为 asyncio + aiohttp")
+    parser.add_argument("--workers", type=int, default=None,
+                        help=f"并发数（thread 默认 {MAX_WORKERS}，async 默认 {ASYNC_CONCURRENCY}）")
+    parser.add_argument("--limit", default=BANDWIDTH_LIMIT,
+                        help="全局带宽上限（字节/秒），支持 K/M/G 后缀，如 20M；0 表示不限速")
+    parser.add_argument("--no-ledger", action="store_true",
+                        help=f"不使用任务台账（默认记录在下载目录的 {LEDGER_FILE}），逐个检查磁盘上的文件；"
+                             "台账记为已完成的文件被删除或 --verify 报告损坏时，删掉坏文件后用它补下")
+    parser.add_argument("--refresh", action="store_true",
+                        help=f"忽略页面缓存（{CATALOG_CACHE_FILE}），重新下载并解析下载页面")
+    parser.add_argument("--verify", action="store_true",
+                        help=f"不下载，按各类别目录的 {MANIFEST_FILE} 并行校验已下载文件")
+    parser.add_argument("--failures", action="store_true",
+                        help="只列出台账中下载失败的条目，不下载")
+    parser.add_argument("--order", choices=("page", "shortest", "round-robin", "largest"), default="page",
+                        help="下载顺序：page 按页面顺序；shortest 小文件优先；round-robin 各类别轮流；"
+                             "largest 大文件优先（适合分段下载）。除 page 外需先批量 HEAD 获取大小")
+    parser.add_argument("--fsync", choices=("end", "none"), default=FSYNC_MODE,
+                        help="落盘策略：end 每个文件下载完成时 fsync；none 交给操作系统")
+    parser.add_argument("--metrics", default=None,
+                        help="把每个文件的耗时、吞吐和重试次数以 JSON Lines 追加写入该文件")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="thread 引擎按吞吐和失败率自动调整并发数（AIMD）")
+    args = parser.parse_args(argv)
+    if args.adaptive and args.engine != "thread":
+        parser.error("--adaptive 只适用于 thread 引擎")
+    return args
+
+def main(argv=None):
     """主函数：抓取网页并下载视频"""
+    global URL, DOWNLOAD_DIR, PROXY, MAX_WORKERS, _rate_limiter, _controller, _ledger, _catalog_cache
+    global _progress, _metrics, _worker_executor, FSYNC_MODE
+    args = parse_args(argv)
+    FSYNC_MODE = args.fsync
+    URL, DOWNLOAD_DIR, PROXY = args.url, args.dir, args.proxy or None
+    if args.engine == "thread" and args.workers:
+        MAX_WORKERS = args.workers
+    limit = parse_rate(args.limit)
+    if limit > 0:
+        _rate_limiter = TokenBucket(limit)
+    
+    if args.verify:
+        problems = verify_tree(DOWNLOAD_DIR, args.workers)
+        sys.exit(1 if problems else 0)
+    
     # 确保下载目录存在
     os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    if not args.no_ledger:
+        _ledger = JobLedger(os.path.join(DOWNLOAD_DIR, LEDGER_FILE))
     
-    # 获取网页内容，使用代理
-    proxies = {"http": PROXY, "https": PROXY}
-    response = requests.get(URL, proxies=proxies)
-    response.raise_for_status()
-    soup = BeautifulSoup(response.content, "html.parser")
-    
-    # 提取所有类别组
-    categories = soup.find_all("div", class_="intl-downloads-group")
-    
-    # 并发下载视频
-    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        for category in categories:
-            # 提取类别标题
-            category_title_div = category.find("div", class_="intl-downloads-group-title")
-            category_title = category_title_div.text.strip() if category_title_div else "未知类别"
-            
-            # 提取类别下的视频项
-            items = category.find_all("div", class_="intl-downloads-item")
-            for item in items:
-                title_div = item.find("div", class_="intl-downloads-item-title")
-                title = title_div.text.strip() if title_div else "未知标题"
-                a_tag = item.find("a")
-                if a_tag and "href" in a_tag.attrs:
-                    url = a_tag["href"]
-                    executor.submit(download_video, category_title, title, url)
-                else:
-                    print(f"未找到 {category_title}/{title} 的下载链接")
+    futures = []
+    try:
+        if args.failures:
+            if _ledger is None:
+                print("未启用任务台账")
+                return
+            for category, title, url, error, bytes_done in _ledger.failures():
+                print(f"{category}/{title}\t{url}\t已下载 {bytes_done} 字节\t{error}")
+            return
+        
+        cache_path = os.path.join(DOWNLOAD_DIR, CATALOG_CACHE_FILE)
+        if args.refresh:
+            _remove_quietly(cache_path)
+        _catalog_cache = CatalogCache(cache_path)
+        
+        if args.adaptive:
+            # 线程池按上限开足，实际同时下载的数量由控制器动态放行；
+            # 线程池在排序、去重的批量 HEAD 时就会建好，所以要先调大 MAX_WORKERS
+            _controller = AdaptiveConcurrency(MAX_WORKERS, ADAPTIVE_MIN_WORKERS, ADAPTIVE_MAX_WORKERS, limit)
+            MAX_WORKERS = ADAPTIVE_MAX_WORKERS
+        
+        # 获取网页内容，使用代理；页面未变化时复用缓存的解析结果。
+        # 单语言页面有变化时 catalog 是边下载边解析的迭代器，线程引擎会边解析边提交下载
+        locales = [locale.strip() for locale in args.locales.split(",") if locale.strip()]
+        duplicates = {}
+        if locales:
+            catalog, changed = fetch_locale_catalogs(locales)
+            everything = catalog
+        else:
+            catalog, changed = open_catalog(URL)
+        if _ledger is not None:
+            # 已完成且 URL 未变的条目直接跳过，不再逐个 stat 文件
+            catalog = _ledger.pending(catalog)
+        if not changed:
+            catalog = list(catalog)
+            if not catalog:
+                print("下载页面未变化，没有新视频")
+                return
+        if locales:
+            # 去重要看全部条目：新增语言的视频往往和台账里已完成的旧语言是同一个文件
+            pending = set(catalog)
+            # 台账里已完成的条目用记录的大小和 ETag，只 HEAD 待下载的 URL
+            known = _ledger.known_contents(everything) if _ledger is not None else None
+            unique, duplicates = plan_dedup(everything, known)
+            catalog = [item for item in unique if item in pending]
+            duplicates = {item: primary for item, primary in duplicates.items() if item in pending}
+            print(f"其中 {len(duplicates)} 个与其他条目内容相同，将硬链接而不重复下载")
+        if args.order != "page":
+            catalog = order_catalog(catalog, args.order)
+        
+        if args.metrics:
+            _metrics = MetricsWriter(args.metrics)
+        _progress = ProgressReporter()
+        _progress.start()
+        
+        if args.engine == "async":
+            catalog = list(catalog)
+            _progress.add_files(len(catalog))
+            asyncio.run(download_all_async(catalog, args.workers))
+            if changed:
+                _catalog_cache.save()
+            link_duplicates(duplicates)
+            _progress.stop()
+            if _metrics is not None:
+                _metrics.close()
+            return
+        
+        # 并发下载视频
+        task = download_video_adaptive if args.adaptive else download_video
+        executor = _get_worker_executor()
+        for item in catalog:
+            futures.append(executor.submit(task, *item))
+            _progress.add_files()
+        submitted = len(futures)
+        # 页面解析完毕（迭代器耗尽）后才有完整的缓存内容
+        if changed:
+            _catalog_cache.save()
+        print(f"页面解析完成，需下载 {submitted} 个视频")
+        concurrent.futures.wait(futures)
+        link_duplicates(duplicates)
+        _progress.stop()
+        if _metrics is not None:
+            _metrics.close()
+        if _controller is not None:
+            _controller.stop()
+            print(f"自适应并发结束时为 {_controller.limit}")
+        
+        stats = connection_stats()
+        print(f"请求 {stats['requests']} 次，新建连接 {stats['new_connections']} 个，复用 {stats['reused']} 次")
+    finally:
+        try:
+            # Ctrl+C 打断等待时工作线程还在下载：取消排队的任务，等正在下载的结束再关台账，
+            # 否则它们完成后写台账会碰到已关闭的数据库。等 future 而不是 join 线程：
+            # 被打断过的 Thread.join 可能把仍在运行的线程当成已结束
+            for future in futures:
+                future.cancel()
+            concurrent.futures.wait(futures)
+            if _worker_executor is not None:
+                _worker_executor.shutdown(wait=False)
+                _worker_executor = None
+        finally:
+            # 任何路径（包括 sys.exit 和异常）退出前都关闭台账，WAL 检查点随之写回主库
+            if _ledger is not None:
+                _ledger.close()
+                _ledger = None
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,293 @@
+# 书签生成器基准测试：生成指定规模的 Netscape 书签文件，分别统计解析、渲染、写出各阶段的耗时和峰值内存，
+# 比较不同解析后端和输出模式；结果可写成 JSON 作为 CI 产物，并与上一次的结果比较找出性能回退
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+from bookmarkgen import (
+    PARSERS, SearchIndexSpool, iter_bookmark_file, iter_folder_links, render_sections, write_full_html,
+    lazy_category, write_lazy_categories, write_shard, write_sharded_manifest,
+)
+
+try:  # Windows 没有 resource 模块，此时不统计峰值内存
+    import resource
+except ImportError:
+    resource = None
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bookmarkgen.py")
+MODES = ("static", "lazy", "sharded")
+ICON = "data:image/png;base64," + "iVBORw0KGgoAAAANSUhEUgAAABAAAAAQ" * 8  # 导出文件里常见的内嵌图标，长度与真实的相当
+TITLE_WORDS = ["文档", "教程", "Python", "GitHub", "博客", "新闻", "工具", "API", "设计", "视频", "论坛", "Wiki"]
+
+def parse_count(text):
+    """解析 1k、100K、1M 这样的数量"""
+    text = text.strip().lower()
+    units = {"k": 1000, "m": 1000 ** 2}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+def format_count(count):
+    for unit, size in (("M", 1000 ** 2), ("k", 1000)):
+        if count >= size and count % size == 0:
+            return f"{count // size}{unit}"
+    return str(count)
+
+def generate_corpus(output, links, depth=3, fanout=5, seed=1, duplicate_rate=0.05, icon_rate=0.1):
+    """向已打开的文本文件写一个 Netscape 书签文件：depth 层、每层 fanout 个子文件夹，links 条书签平均分到各文件夹。
+    每个文件夹先写一半书签、再写子文件夹、最后写另一半，与手工整理过的导出文件一样交错；
+    标题带中文和实体，部分书签带内嵌图标，duplicate_rate 比例的书签与前面的网址重复。同样的参数生成的文件完全相同"""
+    rng = random.Random(seed)
+    folder_count = sum(fanout ** level for level in range(1, depth + 1))
+    per_folder, extra = divmod(links, folder_count)
+    hosts = max(1, links // 50)
+    state = {"folder": 0, "link": 0}
+
+    def write_links(count, indent):
+        for _ in range(count):
+            number = state["link"]
+            state["link"] += 1
+            if number and rng.random() < duplicate_rate:
+                number = rng.randrange(number)
+            title = f"{rng.choice(TITLE_WORDS)} {number} &amp; {rng.choice(TITLE_WORDS)}"
+            icon = f' ICON="{ICON}"' if rng.random() < icon_rate else ""
+            output.write(f'{indent}<DT><A HREF="https://host{number % hosts}.example.com/page/{number}?utm_source=bench&amp;id={number}" '
+                         f'ADD_DATE="{1600000000 + number}"{icon}>{title}</A>\n')
+
+    def write_folder(level, indent):
+        number = state["folder"]
+        state["folder"] += 1
+        count = per_folder + (1 if number < extra else 0)
+        output.write(f'{indent}<DT><H3 ADD_DATE="1600000000" LAST_MODIFIED="1600000000">文件夹 {level}-{number}</H3>\n')
+        output.write(f"{indent}<DL><p>\n")
+        write_links(count // 2, indent + "    ")
+        if level < depth:
+            for _ in range(fanout):
+                write_folder(level + 1, indent + "    ")
+        write_links(count - count // 2, indent + "    ")
+        output.write(f"{indent}</DL><p>\n")
+
+    output.write("<!DOCTYPE NETSCAPE-Bookmark-file-1>\n"
+                 '<META HTTP-EQUIV="Content-Type" CONTENT="text/html; charset=UTF-8">\n'
+                 "<TITLE>Bookmarks</TITLE>\n<H1>Bookmarks</H1>\n<DL><p>\n")
+    for _ in range(fanout):
+        write_folder(1, "    ")
+    output.write("</DL><p>\n")
+
+def corpus_path(directory, links, depth, fanout, seed):
+    """按参数命名并按需生成语料文件，同样参数的语料只生成一次"""
+    filename = os.path.join(directory, f"bookmarks-{format_count(links)}-d{depth}-f{fanout}-s{seed}.html")
+    if not os.path.exists(filename):
+        with open(filename + ".tmp", "w", encoding="utf-8") as f:
+            generate_corpus(f, links, depth, fanout, seed)
+        os.replace(filename + ".tmp", filename)
+    return filename
+
+def peak_rss(usage):
+    """rusage 中的峰值常驻内存（字节）；Linux 以 KB 计，macOS 以字节计"""
+    return usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+
+def measure_phases(corpus, parser, mode, work_dir):
+    """在本进程内分阶段生成一次页面，返回各阶段耗时（秒）。
+    为了分开计时，各阶段的结果都完整留在内存里，所以这里的内存不代表正常流式运行；
+    sharded 模式写分片（含压缩）算在渲染阶段"""
+    timings = {}
+    started = time.perf_counter()
+    records = list(iter_bookmark_file(corpus, parser, "html"))
+    timings["parse"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    folders = list(iter_folder_links(records))
+    search_index = None
+    if mode == "static":
+        search_index = SearchIndexSpool()
+        rendered = list(render_sections(folders, search_index))
+    elif mode == "lazy":
+        rendered = [lazy_category(*folder) for folder in folders]
+    else:
+        # 与 run_case 正常生成的分片分开放，否则分片已存在会跳过写出和压缩
+        shard_dir = os.path.join(work_dir, "phases-shards")
+        os.makedirs(shard_dir, exist_ok=True)
+        rendered = [write_shard(shard_dir, *folder) for folder in folders]
+    timings["render"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with open(os.path.join(work_dir, "phases.html"), "w", encoding="utf-8") as output:
+        if mode == "static":
+            write_full_html(output, rendered, search_index)
+        elif mode == "lazy":
+            write_lazy_categories(output, rendered)
+        else:
+            write_sharded_manifest(output, rendered)
+    timings["write"] = time.perf_counter() - started
+    if search_index is not None:
+        search_index.close()
+    timings["records"] = len(records)
+    timings["folders"] = len(folders)
+    return timings
+
+def run_child(command):
+    """运行子进程，返回 (标准输出, 墙钟时间, CPU 时间, 峰值内存)，退出码非 0 时抛出 RuntimeError；
+    用 wait4 取这一个子进程自己的资源统计，不受之前子进程的影响"""
+    # 标准错误写到临时文件，只从管道读标准输出，不会因为两个管道互相等待而卡住
+    with tempfile.TemporaryFile("w+", encoding="utf-8") as errors:
+        started = time.perf_counter()
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=errors, text=True)
+        stdout = process.stdout.read()
+        process.stdout.close()
+        if resource and hasattr(os, "wait4"):
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            cpu, rss = usage.ru_utime + usage.ru_stime, peak_rss(usage)
+        else:
+            process.wait()
+            cpu, rss = None, None
+        elapsed = time.perf_counter() - started
+        errors.seek(0)
+        stderr = errors.read()
+    if process.returncode:
+        raise RuntimeError(f"{' '.join(command)} 退出码 {process.returncode}: {stderr.strip()[-500:]}")
+    return stdout, elapsed, cpu, rss
+
+def run_case(corpus, links, parser, mode):
+    """对一个语料跑一组 (解析后端, 输出模式)：先用 bookmarkgen.py 正常流式生成一次，统计总耗时和峰值内存；
+    再在子进程里分阶段生成一次，统计解析、渲染、写出各自的耗时"""
+    work_dir = tempfile.mkdtemp(prefix="bookmarkgen-bench-")
+    try:
+        output = os.path.join(work_dir, "navigation.html")
+        _, elapsed, cpu, rss = run_child([
+            sys.executable, SCRIPT, corpus, "-o", output, "--parser", parser, "--mode", mode, "--format", "html",
+        ])
+        # 分片模式的输出大小算上各分片（不含预压缩版本）
+        shard_dir = os.path.join(work_dir, "shards")
+        shards = os.listdir(shard_dir) if os.path.isdir(shard_dir) else []
+        output_bytes = os.path.getsize(output) + sum(
+            os.path.getsize(os.path.join(shard_dir, name)) for name in shards if name.endswith(".json")
+        )
+        stdout, _, _, _ = run_child([
+            sys.executable, os.path.abspath(__file__), "phases", corpus, "--parser", parser, "--mode", mode,
+            "--work-dir", work_dir,
+        ])
+        phases = json.loads(stdout)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        "links": links,
+        "parser": parser,
+        "mode": mode,
+        "records": phases["records"],
+        "folders": phases["folders"],
+        "parse": round(phases["parse"], 4),
+        "render": round(phases["render"], 4),
+        "write": round(phases["write"], 4),
+        "seconds": round(elapsed, 4),
+        "cpu": round(cpu, 4) if cpu is not None else None,
+        "peak_rss": rss,
+        "output_bytes": output_bytes,
+        "links_per_second": round(links / elapsed) if elapsed > 0 else None,
+    }
+
+def format_row(row):
+    rss = f"{row['peak_rss'] / 1024 ** 2:.0f}MB" if row["peak_rss"] is not None else "--"
+    return (f"{format_count(row['links']):>6}  {row['parser']:<12}{row['mode']:<9}"
+            f"{row['parse']:>9.3f}s{row['render']:>9.3f}s{row['write']:>9.3f}s"
+            f"{row['seconds']:>9.3f}s{rss:>9}{row['output_bytes'] / 1024 ** 2:>9.1f}MB")
+
+def compare(rows, baseline, tolerance):
+    """与基线结果比较总耗时和峰值内存，返回超出 tolerance（比例）的条目说明"""
+    previous = {(row["links"], row["parser"], row["mode"]): row for row in baseline}
+    regressions = []
+    for row in rows:
+        old = previous.get((row["links"], row["parser"], row["mode"]))
+        if old is None:
+            continue
+        for field in ("seconds", "peak_rss"):
+            if row.get(field) and old.get(field):
+                ratio = row[field] / old[field]
+                row[f"{field}_ratio"] = round(ratio, 3)
+                if ratio > 1 + tolerance:
+                    regressions.append(f"{format_count(row['links'])} {row['parser']} {row['mode']} "
+                                       f"{field}: {old[field]} -> {row[field]}（{ratio:.2f} 倍）")
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="书签生成器基准测试")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate = commands.add_parser("generate", help="生成合成的 Netscape 书签文件")
+    generate.add_argument("output", help="输出文件")
+    generate.add_argument("--links", default="10k", help="书签数量，支持 k/M 后缀")
+    generate.add_argument("--depth", type=int, default=3, help="文件夹层数")
+    generate.add_argument("--fanout", type=int, default=5, help="每个文件夹的子文件夹数")
+    generate.add_argument("--seed", type=int, default=1, help="随机种子")
+
+    run = commands.add_parser("run", help="生成各规模的语料并运行基准测试")
+    run.add_argument("--sizes", default="1k,10k,100k", help="逗号分隔的书签数量列表，支持 k/M 后缀，如 1k,100k,1M")
+    run.add_argument("--depth", type=int, default=3, help="文件夹层数")
+    run.add_argument("--fanout", type=int, default=5, help="每个文件夹的子文件夹数")
+    run.add_argument("--seed", type=int, default=1, help="随机种子")
+    run.add_argument("--parsers", default=",".join(PARSERS), help="逗号分隔的解析后端列表")
+    run.add_argument("--modes", default="static,lazy", help=f"逗号分隔的输出模式列表，可选 {','.join(MODES)}")
+    run.add_argument("--corpus-dir", default=None, help="语料存放目录，指定时保留语料供下次复用；默认用临时目录")
+    run.add_argument("--json", default=None, help="把结果写入该 JSON 文件（CI 产物）")
+    run.add_argument("--baseline", default=None, help="上一次的结果 JSON，与之比较总耗时和峰值内存")
+    run.add_argument("--tolerance", type=float, default=0.2, help="超过基线多少比例算回退，此时退出码为 1")
+
+    phases = commands.add_parser("phases", help="（供 run 调用）分阶段生成一次页面，输出各阶段耗时的 JSON")
+    phases.add_argument("corpus")
+    phases.add_argument("--parser", choices=sorted(PARSERS), default="fast")
+    phases.add_argument("--mode", choices=MODES, default="static")
+    phases.add_argument("--work-dir", required=True)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.command == "generate":
+        links = parse_count(args.links)
+        with open(args.output, "w", encoding="utf-8") as f:
+            generate_corpus(f, links, args.depth, args.fanout, args.seed)
+        print(f"已生成 {links} 条书签，保存到 {args.output} 文件中。")
+        return 0
+
+    if args.command == "phases":
+        print(json.dumps(measure_phases(args.corpus, args.parser, args.mode, args.work_dir)))
+        return 0
+
+    corpus_dir = args.corpus_dir or tempfile.mkdtemp(prefix="bookmarkgen-corpus-")
+    os.makedirs(corpus_dir, exist_ok=True)
+    print(f"{'links':>6}  {'parser':<12}{'mode':<9}{'parse':>10}{'render':>10}{'write':>10}"
+          f"{'total':>10}{'peak':>9}{'output':>11}")
+    rows = []
+    try:
+        for size in args.sizes.split(","):
+            links = parse_count(size)
+            corpus = corpus_path(corpus_dir, links, args.depth, args.fanout, args.seed)
+            for parser in args.parsers.split(","):
+                for mode in args.modes.split(","):
+                    row = run_case(corpus, links, parser.strip(), mode.strip())
+                    rows.append(row)
+                    print(format_row(row))
+    finally:
+        if not args.corpus_dir:
+            shutil.rmtree(corpus_dir, ignore_errors=True)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(rows, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"性能回退: {regression}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,61 +1,724 @@
 #书签生成器  书签生成网址导航
-from bs4 import BeautifulSoup
+import io
+import os
+import re
+import gzip
+import json
+import time
+import base64
+import hashlib
+import functools
+import asyncio
+import sqlite3
+import pathlib
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from html import escape, unescape
+from html.parser import HTMLParser
+from urllib.parse import parse_qsl, urlencode
 
-def generate_navigation_sections(input_html):
-    soup = BeautifulSoup(input_html, "html.parser")
-    navigation_sections = ""
-    # 遍历所有 H3 标签（代表分类名称）
-    for h3 in soup.find_all("h3"):
-        category = h3.get_text(strip=True)
-        # 获取该分类对应的链接列表，通常位于后续的 <DL> 标签中
-        dl = h3.find_next_sibling("dl")
-        if not dl:
+READ_CHUNK = 1024 * 1024  # 流式解析时每次读取的字符数
+MERGE_WORKERS = os.cpu_count() or 1  # 合并多个书签文件时的解析进程数
+INPUT_FORMATS = ("auto", "html", "chromium", "firefox")  # 输入格式：书签导出 HTML、Chromium 的 Bookmarks、Firefox 的 places.sqlite
+# Firefox 几个根文件夹在数据库里的标题是内部名称，按 guid 换成界面上的名字；标签根目录不是书签，跳过
+FIREFOX_ROOTS = {
+    "menu________": "书签菜单",
+    "toolbar_____": "书签工具栏",
+    "unfiled_____": "其他书签",
+    "mobile______": "移动设备书签",
+}
+FIREFOX_SKIPPED_ROOTS = {"tags________"}
+# 合并去重时忽略的跟踪参数：精确名称，以及 utm_ 等前缀
+TRACKING_PARAMS = {"fbclid", "gclid", "dclid", "msclkid", "yclid", "mc_cid", "mc_eid", "igshid", "spm", "_ga", "ref_src"}
+TRACKING_PREFIXES = ("utm_",)
+FAVICON_CACHE_FILE = "favicons.sqlite3"  # 图标缓存文件，按源（协议 + 主机）存放
+FAVICON_TTL = 7 * 24 * 3600  # 取到的图标缓存有效期（秒）
+FAVICON_FAILURE_TTL = 24 * 3600  # 取不到图标的源在这段时间内不再重试（秒）
+FAVICON_CONCURRENCY = 64  # 同时请求图标的连接数，每个主机最多一个连接
+FAVICON_TIMEOUT = 10  # 单个图标请求的超时（秒）
+FAVICON_MAX_SIZE = 64 * 1024  # 超过此大小的图标不内嵌
+SHARD_DIR = "shards"  # 分片模式下各分类 JSON 分片所在的目录（相对输出页面）
+SHARD_HASH_LENGTH = 16  # 分片文件名中内容哈希的十六进制位数
+BROTLI_QUALITY = 11  # 预压缩用的 brotli 等级；分片按内容命名只压缩一次，默认取最高压缩率
+WATCH_INTERVAL = 1.0  # 监视模式检查输入文件是否变化的间隔（秒）
+LINK_CACHE_FILE = "links.sqlite3"  # 链接检查结果缓存文件，按网址存放
+LINK_TTL = 24 * 3600  # 链接检查结果的有效期（秒）
+LINK_CONCURRENCY = 100  # 同时检查的链接数
+LINK_PER_HOST = 2  # 每个主机最多同时打开的连接数
+LINK_TIMEOUT = 15  # 链接检查中连接和读取的超时（秒），不含等待连接名额的时间
+DEAD_STATUSES = {404, 410}  # 视为失效的 HTTP 状态码；连接失败和 5xx 可能只是暂时的，只标记为无法访问
+ORIGIN = re.compile(r"https?://[a-z0-9.\-:\[\]]+(?=[/?#]|$)", re.IGNORECASE)
+URL_PARTS = re.compile(r"https?://([^/?#]*)([^?#]*)(?:\?([^#]*))?(?:#(.*))?", re.IGNORECASE | re.DOTALL)
+
+class BookmarkParser(HTMLParser):
+    """单遍解析 Netscape 书签导出文件：用栈记录当前所在的文件夹路径，
+    每遇到一个 <A> 就产出一条 (文件夹路径, 标题, 网址)，总耗时与书签数量成正比"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.folders = []  # 每个未闭合 <DL> 对应的文件夹名；没有 <H3> 的 <DL>（如根列表）为 None
+        self.current_path = ()  # 由 folders 算出的当前文件夹路径，只在进出 <DL> 时更新
+        self.pending_folder = None  # 刚读完的 <H3> 文件夹名，等待其后的 <DL>
+        self.text = None  # 正在收集文字的 <H3> 或 <A>
+        self.href = None
+        self.records = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "h3":
+            self.text = []
+        elif tag == "a":
+            self.text = []
+            self.href = dict(attrs).get("href")
+        elif tag == "dl":
+            self.folders.append(self.pending_folder)
+            self.pending_folder = None
+            self.current_path = self.path()
+
+    def handle_endtag(self, tag):
+        if tag == "h3" and self.text is not None:
+            self.pending_folder = "".join(self.text).strip()
+            self.text = None
+        elif tag == "a" and self.text is not None:
+            if self.href:
+                self.records.append((self.current_path, "".join(self.text).strip(), self.href))
+            self.text = None
+            self.href = None
+        elif tag == "dl" and self.folders:
+            self.folders.pop()
+            self.current_path = self.path()
+
+    def handle_data(self, data):
+        if self.text is not None:
+            self.text.append(data)
+
+    def path(self):
+        """当前文件夹路径（元组），根目录为空元组"""
+        return tuple(name for name in self.folders if name is not None)
+
+    def drain(self):
+        """取出目前已解析出的书签"""
+        records, self.records = self.records, []
+        return records
+
+class FastBookmarkParser(BookmarkParser):
+    """浏览器导出的书签文件格式固定，只需关心 <DL>、<H3>、<A> 三种标签：
+    用正则直接扫描标签，再交给 BookmarkParser 的同一套处理逻辑，比逐个解析所有标签的 HTMLParser 快得多。
+    手工编辑过、格式不规范的文件可改用 html.parser 后端"""
+
+    TAG = re.compile(r"<(/?)(dl|h3|a)(?=[\s>/])([^>]*)>", re.IGNORECASE)
+    # 属性值里带 ">"（如网址查询串）时 TAG 会在引号中间截断，这时改用能跳过引号内整段的写法重新匹配。
+    # 各分支互斥（普通字符一次吃到下一个引号或 ">"，两种引号写法由同一行后面有没有配对引号区分），
+    # 每个位置只有一种匹配方式，写坏的标签也不会引起回溯爆炸
+    QUOTED_TAG = re.compile(
+        r"""<(/?)(dl|h3|a)(?=[\s>/])((?:[^>"']+(?![^>"'])|"[^"\n]*"|'[^'\n]*'|"(?![^"\n]*")|'(?![^'\n]*'))*)>""",
+        re.IGNORECASE,
+    )
+    # 引号成对、已经收尾的标签
+    COMPLETE_TAG = re.compile(r"""<(?:[^>"']|"[^"]*"|'[^']*')*>""")
+    HREF = re.compile(r"""\bhref\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""", re.IGNORECASE)
+
+    def __init__(self):
+        super().__init__()
+        self.buffer = ""
+
+    def feed(self, data):
+        data = self.buffer + data
+        # 最后一个 '<' 之后可能是被块边界截断的标签（截断处可能正好在引号内的 ">" 之后），留到下次再处理
+        cut = data.rfind("<")
+        if cut == -1 or self.COMPLETE_TAG.match(data, cut):
+            cut = len(data)
+        self.buffer = data[cut:]
+        self._scan(data[:cut])
+
+    def close(self):
+        data, self.buffer = self.buffer, ""
+        self._scan(data)
+
+    def _scan(self, data):
+        position = 0
+        while True:
+            match = self.TAG.search(data, position)
+            if match is None:
+                break
+            attrs = match.group(3)
+            if attrs.count('"') % 2 or attrs.count("'") % 2:
+                match = self.QUOTED_TAG.match(data, match.start()) or match
+            if self.text is not None and match.start() > position:
+                self.handle_data(data[position:match.start()])
+            closing, tag, attrs = match.groups()
+            tag = tag.lower()
+            if closing:
+                self.handle_endtag(tag)
+            elif tag == "a":
+                # 只用得到 href，不必解析其它属性（ICON 等可能很长）
+                href = self.HREF.search(attrs)
+                value = next((group for group in href.groups() if group is not None), "") if href else ""
+                self.handle_starttag(tag, [("href", unescape(value))] if href else [])
+            else:
+                self.handle_starttag(tag, [])
+            position = match.end()
+        if self.text is not None and position < len(data):
+            self.handle_data(data[position:])
+
+    def handle_endtag(self, tag):
+        # 文字片段可能在块边界处截断了实体，等整段收齐再去掉残留标签（如 <b>）并反转义
+        if self.text is not None and tag in ("h3", "a"):
+            text = "".join(self.text)
+            if "<" in text:
+                text = re.sub(r"<[^>]*>", "", text)
+            self.text = [unescape(text)]
+        super().handle_endtag(tag)
+
+PARSERS = {
+    "fast": FastBookmarkParser,
+    "html.parser": BookmarkParser,
+}
+
+def iter_bookmarks(source, parser="fast"):
+    """流式解析书签文件，逐条产出 (文件夹路径, 标题, 网址)。
+    source 可以是 HTML 字符串或已打开的文本文件，文件按块读取，内存占用与文件大小无关；
+    parser 为 PARSERS 中的后端名"""
+    if isinstance(source, str):
+        source = io.StringIO(source)
+    parser = PARSERS[parser]()
+    for chunk in iter(lambda: source.read(READ_CHUNK), ""):
+        parser.feed(chunk)
+        yield from parser.drain()
+    parser.close()
+    yield from parser.drain()
+
+def iter_folder_links(records):
+    """把 (文件夹路径, 标题, 网址) 流归并为文件夹，逐个产出 (路径, 序号, [(标题, 网址)])。
+    某个文件夹之后出现的书签不再属于它或它的子文件夹时即视为该文件夹结束，
+    所以只需缓存当前仍打开的文件夹，内存与书签总数无关。
+    序号为文件夹首次出现的先后：子文件夹写在父文件夹自己的书签之前时，父文件夹仍排在前面"""
+    open_folders = {}
+    orders = {}  # 当前路径上各级文件夹的序号，包括还没有直接书签的上级
+    count = 0
+    for path, title, href in records:
+        # 不在任何文件夹中的书签没有分类名，与原先一样跳过
+        if not path:
             continue
-        links_html = ""
-        # 遍历 <DL> 中的所有 <A> 标签
-        for a in dl.find_all("a"):
-            href = a.get("href")
-            text = a.get_text(strip=True)
-            links_html += f'    <a href="{href}" class="link-item" target="_blank">{text}</a>\n'
-        # 生成当前分类的 HTML 部分
-        section = (
-            f'<div class="category" data-category="{category}">\n'
-            f'  <h2>{category}</h2>\n'
-            f'  <div class="links">\n{links_html}  </div>\n'
-            f'</div>\n'
+        for open_path in [p for p in open_folders if path[:len(p)] != p]:
+            yield (open_path, *open_folders.pop(open_path))
+        for prefix in [p for p in orders if path[:len(p)] != p]:
+            del orders[prefix]
+        for depth in range(1, len(path) + 1):
+            if path[:depth] not in orders:
+                orders[path[:depth]] = count
+                count += 1
+        entry = open_folders.get(path)
+        if entry is None:
+            entry = open_folders[path] = (orders[path], [])
+        entry[1].append((title, href))
+    for open_path, entry in open_folders.items():
+        yield (open_path, *entry)
+
+def iter_chromium_bookmarks(source):
+    """解析 Chromium 系浏览器（Chrome、Edge 等）的 Bookmarks 文件，逐条产出 (文件夹路径, 标题, 网址)。
+    书签栏、其他书签等根节点作为第一级文件夹，与导出的 HTML 一致。
+    文件里文件夹的 name 写在 children 之后，边读边解码也得先缓存整个子树，所以直接用 C 实现的 json 一次解码"""
+    data = json.load(source)
+
+    def walk(node, path):
+        for child in node.get("children", ()):
+            kind = child.get("type")
+            if kind == "url":
+                yield path, child.get("name", "").strip(), child.get("url", "")
+            elif kind == "folder":
+                yield from walk(child, path + (child.get("name", "").strip(),))
+
+    for root in data.get("roots", {}).values():
+        # roots 中还可能有 sync_transaction_version 之类的非文件夹字段
+        if isinstance(root, dict):
+            yield from walk(root, (root.get("name", "").strip(),))
+
+def iter_firefox_bookmarks(filename):
+    """以只读方式查询 Firefox 的 places.sqlite，按书签在浏览器中的顺序逐条产出 (文件夹路径, 标题, 网址)"""
+    uri = pathlib.Path(filename).resolve().as_uri()
+    query = (
+        "SELECT b.id, b.parent, b.type, b.title, p.url, b.guid FROM moz_bookmarks b "
+        "LEFT JOIN moz_places p ON p.id = b.fk WHERE b.type IN (1, 2) ORDER BY b.parent, b.position"
+    )
+    try:
+        conn = sqlite3.connect(f"{uri}?mode=ro", uri=True)
+        try:
+            rows = conn.execute(query).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.OperationalError:
+        # Firefox 运行时独占锁住数据库：改为按不可变文件读取，只是读不到还在 WAL 里未合并的最新修改
+        conn = sqlite3.connect(f"{uri}?immutable=1", uri=True)
+        try:
+            rows = conn.execute(query).fetchall()
+        finally:
+            conn.close()
+    children = {}
+    for row in rows:
+        children.setdefault(row[1], []).append(row)
+
+    def walk(folder_id, path):
+        for item_id, parent, kind, title, url, guid in children.get(folder_id, ()):
+            if kind == 1:
+                # place: 开头的是“最近添加”之类的智能书签，不是网址
+                if url and not url.startswith("place:"):
+                    yield path, (title or "").strip(), url
+            elif guid not in FIREFOX_SKIPPED_ROOTS:
+                yield from walk(item_id, path + (FIREFOX_ROOTS.get(guid, (title or "").strip()),))
+
+    # 根节点（root________）的 parent 为 0，本身不算一级文件夹
+    for root in children.get(0, ()):
+        yield from walk(root[0], ())
+
+def detect_format(filename):
+    """按文件开头判断书签文件格式：SQLite 数据库为 firefox，JSON 为 chromium，其余按 HTML 处理"""
+    with open(filename, "rb") as f:
+        head = f.read(64)
+    if head.startswith(b"SQLite format 3\0"):
+        return "firefox"
+    if head.lstrip(b"\xef\xbb\xbf \t\r\n").startswith(b"{"):
+        return "chromium"
+    return "html"
+
+def iter_bookmark_file(filename, parser="fast", input_format="auto"):
+    """读取一个书签文件，逐条产出 (文件夹路径, 标题, 网址)；input_format 为 INPUT_FORMATS 之一，
+    parser 只对 HTML 有效"""
+    if input_format == "auto":
+        input_format = detect_format(filename)
+    if input_format == "firefox":
+        yield from iter_firefox_bookmarks(filename)
+        return
+    with open(filename, "r", encoding="utf-8") as f:
+        if input_format == "chromium":
+            yield from iter_chromium_bookmarks(f)
+        else:
+            yield from iter_bookmarks(f, parser)
+
+def normalize_url(href):
+    """合并去重用的网址键：忽略 http/https 的区别、主机名大小写、默认端口、路径末尾的 /、
+    跟踪参数和空片段，其余查询参数按名称排序。非 http(s) 网址原样返回。
+    书签动辄几十万条，这里用一个正则拆分网址，比 urlsplit 快得多"""
+    match = URL_PARTS.match(href.strip())
+    if match is None:
+        return href.strip()
+    host, path, query, fragment = match.groups()
+    host = host.lower().rstrip(".")
+    if host.endswith((":80", ":443")):
+        host = host.rpartition(":")[0]
+    if query:
+        query = urlencode(sorted(
+            (name, value) for name, value in parse_qsl(query, keep_blank_values=True)
+            if name.lower() not in TRACKING_PARAMS and not name.lower().startswith(TRACKING_PREFIXES)
+        ))
+    key = f"//{host}{path.rstrip('/')}"
+    if query:
+        key += f"?{query}"
+    if fragment:
+        key += f"#{fragment}"
+    return key
+
+def parse_export(filename, parser="fast", input_format="auto"):
+    """解析一个书签文件，返回 [(文件夹路径, 标题, 网址, 去重键)]；供进程池调用，去重键也在子进程里算好"""
+    return [
+        (path, title, href, normalize_url(href))
+        for path, title, href in iter_bookmark_file(filename, parser, input_format)
+    ]
+
+def merge_exports(filenames, parser="fast", workers=MERGE_WORKERS, input_format="auto"):
+    """用进程池并行解析多个书签文件，按网址去重后合并为文件夹列表 [(路径, 序号, [(标题, 网址)])]。
+    同一网址只保留最先出现（按文件参数顺序）的那一条；同名文件夹跨文件合并，序号为首次出现的先后。
+    去重键放在集合里，总耗时与书签总数成正比"""
+    workers = max(1, min(workers, len(filenames)))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        exports = executor.map(parse_export, filenames, [parser] * len(filenames), [input_format] * len(filenames))
+        seen = set()
+        folders = {}
+        orders = {}
+        for records in exports:
+            for path, title, href, key in records:
+                # 不在任何文件夹中的书签没有分类名，与单文件时一样跳过
+                if not path or key in seen:
+                    continue
+                seen.add(key)
+                links = folders.get(path)
+                if links is None:
+                    links = folders[path] = []
+                    # 上级文件夹即使自己的书签出现得晚，也排在子文件夹前面
+                    for depth in range(1, len(path) + 1):
+                        orders.setdefault(path[:depth], len(orders))
+                links.append((title, href))
+    return sorted(((path, orders[path], links) for path, links in folders.items()), key=lambda folder: folder[1])
+
+def render_section(path, order, links):
+    """生成一个分类的 HTML 部分；链接可带第三项状态（如 "dead"），渲染为 link-<状态> 样式"""
+    category = escape(" / ".join(path))
+    links_html = "".join(
+        f'    <a href="{escape(href)}" class="link-item{"".join(f" link-{s}" for s in state)}" target="_blank">'
+        f'{escape(title)}</a>\n'
+        for title, href, *state in links
+    )
+    return (
+        f'<div class="category" data-category="{category}" style="order: {order}">\n'
+        f'  <h2>{category}</h2>\n'
+        f'  <div class="links">\n{links_html}  </div>\n'
+        f'</div>\n'
+    )
+
+def iter_folders(input_html, parser="fast"):
+    """流式解析书签文件，逐个产出文件夹 (路径, 序号, [(标题, 网址)])"""
+    return iter_folder_links(iter_bookmarks(input_html, parser))
+
+def render_sections(folders, search_index=None):
+    """逐个产出各文件夹的分类 HTML 片段；给出 search_index（SearchIndexSpool）时
+    同时按页面中的链接顺序登记搜索索引"""
+    for path, order, links in folders:
+        if search_index is not None:
+            search_index.add_links(links)
+        yield render_section(path, order, links)
+
+def iter_navigation_sections(input_html, parser="fast", search_index=None):
+    """边解析边逐个产出各分类的 HTML 片段"""
+    return render_sections(iter_folders(input_html, parser), search_index)
+
+def script_json(text):
+    """把 JSON 文本转成可以放进 <script> 块的形式：所有 "<" 写成 \\u003c（JSON 解析结果不变），
+    书签内容里的 "</script>" 不会提前结束脚本块，"<!--<script" 也不会让浏览器进入双重转义状态"""
+    return text.replace("<", "\\u003c")
+
+def search_index_line(links):
+    """一个分类的搜索索引：整批序列化为一行（不含方括号的 JSON 数组元素），没有链接时返回 None"""
+    if not links:
+        return None
+    entries = [f"{title}\n{href}".lower() for title, href, *_ in links]
+    return json.dumps(entries, ensure_ascii=False)[1:-1]
+
+def write_search_index(output, lines):
+    """把各分类的索引行作为 JSON 写进 <script type="application/json">"""
+    output.write('<script type="application/json" id="search-index">[')
+    for number, line in enumerate(lines):
+        if number:
+            output.write(",")
+        output.write(script_json(line))
+    output.write("]</script>\n")
+
+class SearchIndexSpool:
+    """预先计算的搜索索引：每个链接一条小写的“名称\n网址”，顺序与页面中的链接一致。
+    生成时先逐条写入临时文件，页面写完分类后再拷进页面，不必把整个索引留在内存里"""
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile("w+", encoding="utf-8")
+        self.count = 0
+
+    def add_links(self, links):
+        """登记一个分类的链接"""
+        line = search_index_line(links)
+        if line is None:
+            return
+        self.file.write(line)
+        self.file.write("\n")
+        self.count += len(links)
+
+    def write_script(self, output):
+        """把索引写进页面"""
+        self.file.seek(0)
+        write_search_index(output, (line.rstrip("\n") for line in self.file))
+
+    def close(self):
+        self.file.close()
+
+def link_origin(href):
+    """网址所属的源（小写的 协议://主机[:端口]），非 http(s) 网址返回 None"""
+    match = ORIGIN.match(href)
+    return match.group().lower() if match else None
+
+def collect_origins(folders, origins):
+    """原样转发文件夹序列，顺带把链接的源收集进 origins 集合，供生成页面后抓取图标"""
+    for folder in folders:
+        for title, href, *_ in folder[2]:
+            origin = link_origin(href)
+            if origin is not None:
+                origins.add(origin)
+        yield folder
+
+class FaviconCache:
+    """SQLite 图标缓存：每个源一行，记录图标数据、类型和抓取时间；取不到图标也记一行（data 为空），
+    过期前不再重复请求"""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS favicons (
+                origin TEXT PRIMARY KEY,
+                content_type TEXT,
+                data BLOB,
+                fetched_at REAL NOT NULL
+            )"""
         )
-        navigation_sections += section
-    return navigation_sections
+        self.conn.commit()
 
-def generate_full_html(navigation_sections):
-    # HTML 模板，包含动态 CSS 效果和搜索框功能
-    html_template = f'''<!DOCTYPE html>
+    def fresh(self, origins):
+        """返回未过期的缓存 {源: (类型, 数据) 或 None}"""
+        now = time.time()
+        cached = {}
+        for origin, content_type, data, fetched_at in self.conn.execute(
+            "SELECT origin, content_type, data, fetched_at FROM favicons"
+        ):
+            if origin not in origins:
+                continue
+            ttl = FAVICON_TTL if data else FAVICON_FAILURE_TTL
+            if now - fetched_at < ttl:
+                cached[origin] = (content_type, data) if data else None
+        return cached
+
+    def store(self, icons):
+        """写入一批抓取结果 {源: (类型, 数据) 或 None}"""
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO favicons (origin, content_type, data, fetched_at) VALUES (?, ?, ?, ?)",
+            [(origin, *(icon or (None, None)), now) for origin, icon in icons.items()],
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+async def fetch_favicon(session, origin):
+    """请求 源/favicon.ico，返回 (类型, 数据)；不是图片、过大或请求失败时返回 None"""
+    import aiohttp
+
+    try:
+        async with session.get(f"{origin}/favicon.ico") as response:
+            if response.status != 200:
+                return None
+            content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+            # 不少站点对不存在的路径返回 200 的 HTML 页面
+            if content_type and not content_type.startswith("image/") and content_type != "application/octet-stream":
+                return None
+            data = await response.content.read(FAVICON_MAX_SIZE + 1)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+        return None
+    if not data or len(data) > FAVICON_MAX_SIZE:
+        return None
+    return (content_type if content_type.startswith("image/") else "image/x-icon", data)
+
+async def fetch_favicons(origins, concurrency=FAVICON_CONCURRENCY):
+    """用固定数量的协程抓取一组源的图标，返回 {源: (类型, 数据) 或 None}。
+    连接池对每个主机只开一个 keep-alive 连接，同一主机的请求复用它，不会同时压到一个站点上"""
+    import aiohttp
+
+    pending = list(origins)
+    icons = {}
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=1)
+    timeout = aiohttp.ClientTimeout(total=FAVICON_TIMEOUT)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async def worker():
+            while pending:
+                origin = pending.pop()
+                icons[origin] = await fetch_favicon(session, origin)
+
+        await asyncio.gather(*(worker() for _ in range(min(concurrency, len(pending)))))
+    return icons
+
+def load_favicons(origins, cache_file=FAVICON_CACHE_FILE, concurrency=FAVICON_CONCURRENCY):
+    """取得一组源的图标：先查缓存，只抓取缓存中没有或已过期的，结果写回缓存。返回 {源: (类型, 数据)}"""
+    cache = FaviconCache(cache_file)
+    try:
+        icons = cache.fresh(origins)
+        missing = [origin for origin in origins if origin not in icons]
+        if missing:
+            fetched = asyncio.run(fetch_favicons(missing, concurrency))
+            cache.store(fetched)
+            icons.update(fetched)
+    finally:
+        cache.close()
+    return {origin: icon for origin, icon in icons.items() if icon is not None}
+
+def write_favicon_stylesheet(output, icons):
+    """把图标写成一个 data URI 样式表：按链接网址前缀匹配源，页面只需一次请求就能拿到全部图标。
+    多个源共用同一个图标（如托管平台的默认图标）时合并为一条规则"""
+    groups = {}
+    for origin, icon in sorted(icons.items()):
+        groups.setdefault(icon, []).append(origin)
+    output.write(".link-item { background-repeat: no-repeat; background-position: 12px center; background-size: 16px 16px; }\n")
+    for (content_type, data), origins in groups.items():
+        selectors = ",\n".join(
+            f'.link-item[href^="{origin}/" i], .link-item[href="{origin}" i]' for origin in origins
+        )
+        uri = f"data:{content_type};base64,{base64.b64encode(data).decode('ascii')}"
+        output.write(f'{selectors} {{\n  padding-left: 36px;\n  background-image: url("{uri}");\n}}\n')
+
+def favicon_stylesheet_name(output_filename):
+    """图标样式表的文件名：与输出页面同目录、同名，扩展名为 .icons.css"""
+    base = output_filename[:-3] if output_filename.endswith(".gz") else output_filename
+    return os.path.splitext(base)[0] + ".icons.css"
+
+class LinkCache:
+    """SQLite 链接检查缓存：每个网址一行，记录状态码、跳转后的网址和检查时间，过期前不再重复检查"""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS links (
+                url TEXT PRIMARY KEY,
+                status INTEGER NOT NULL,
+                final_url TEXT,
+                checked_at REAL NOT NULL
+            )"""
+        )
+        self.conn.commit()
+
+    def fresh(self, urls):
+        """返回未过期的检查结果 {网址: (状态码, 跳转后的网址)}"""
+        now = time.time()
+        return {
+            url: (status, final_url)
+            for url, status, final_url, checked_at in self.conn.execute(
+                "SELECT url, status, final_url, checked_at FROM links"
+            )
+            if url in urls and now - checked_at < LINK_TTL
+        }
+
+    def store(self, results):
+        """写入一批检查结果 {网址: (状态码, 跳转后的网址)}"""
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO links (url, status, final_url, checked_at) VALUES (?, ?, ?, ?)",
+            [(url, status, final_url, now) for url, (status, final_url) in results.items()],
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+async def check_link(session, url):
+    """检查一个链接，返回 (状态码, 跳转后的网址)；连接失败时状态码为 0，超时时为 None。
+    先发 HEAD，服务器不支持或 HEAD 出错时改用只取第一个字节的 GET"""
+    import aiohttp
+
+    for method, headers in (("HEAD", None), ("GET", {"Range": "bytes=0-0"})):
+        try:
+            async with session.request(method, url, headers=headers) as response:
+                status, final_url = response.status, str(response.url)
+        except asyncio.TimeoutError:
+            # 超时的主机再试一次 GET 多半也是超时；超时不能说明链接失效
+            return None, url
+        except (aiohttp.ClientError, ValueError):
+            status, final_url = 0, url
+        if status and status < 400:
+            break
+    return status, final_url
+
+async def check_links_async(urls, concurrency=LINK_CONCURRENCY):
+    """检查一组链接，返回 {网址: (状态码, 跳转后的网址)}。
+    每个主机一组协程，最多 LINK_PER_HOST 个，全部主机合计最多 concurrency 个请求同时进行；
+    协程只在拿到连接名额后才发请求，超时只计算连接和读取本身，不含排队等待的时间"""
+    import aiohttp
+
+    hosts = {}
+    for url in urls:
+        hosts.setdefault(link_origin(url), []).append(url)
+    results = {}
+    slots = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=LINK_PER_HOST)
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=LINK_TIMEOUT, sock_read=LINK_TIMEOUT)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async def worker(pending):
+            while pending:
+                url = pending.pop()
+                async with slots:
+                    results[url] = await check_link(session, url)
+
+        await asyncio.gather(*(
+            worker(pending)
+            for pending in hosts.values()
+            for _ in range(min(LINK_PER_HOST, len(pending)))
+        ))
+    return results
+
+def check_links(urls, cache_file=LINK_CACHE_FILE, concurrency=LINK_CONCURRENCY):
+    """检查一组 http(s) 链接：先查缓存，只检查缓存中没有或已过期的，结果写回缓存。
+    返回 {网址: 状态}，状态为 "ok"、"dead"、"unreachable"（连接失败或 5xx）或 "redirected"（跳转到了实质不同的网址）。
+    超时、连接失败和 5xx 可能只是暂时的，不写入缓存，下次重新检查"""
+    urls = {url for url in urls if link_origin(url) is not None}
+    cache = LinkCache(cache_file)
+    try:
+        results = cache.fresh(urls)
+        missing = [url for url in urls if url not in results]
+        if missing:
+            checked = asyncio.run(check_links_async(missing, concurrency))
+            cache.store({url: result for url, result in checked.items() if result[0] and result[0] < 500})
+            results.update(checked)
+    finally:
+        cache.close()
+    states = {}
+    timed_out = 0
+    for url, (status, final_url) in results.items():
+        if status is None:
+            # 超时不当作失效，保持原样
+            timed_out += 1
+            states[url] = "ok"
+        elif status in DEAD_STATUSES:
+            states[url] = "dead"
+        elif status == 0 or status >= 500:
+            # 只标记不删除：一次 503 不该让书签消失
+            states[url] = "unreachable"
+        elif normalize_url(final_url) != normalize_url(url):
+            # http→https、末尾加 / 之类的跳转不算
+            states[url] = "redirected"
+        else:
+            states[url] = "ok"
+    if timed_out:
+        print(f"{timed_out} 个链接检查超时，未标记")
+    return states
+
+def mark_links(folders, states, prune=False):
+    """按链接检查结果给文件夹中的链接加上状态（失效 dead、无法访问 unreachable、跳转 redirected）；
+    prune 为真时直接去掉失效链接，去掉后为空的文件夹也不再输出"""
+    for path, order, links in folders:
+        marked = []
+        for title, href in links:
+            state = states.get(href, "ok")
+            if state == "ok":
+                marked.append((title, href))
+            elif not (prune and state == "dead"):
+                marked.append((title, href, state))
+        if marked or not links:
+            yield path, order, marked
+
+def generate_navigation_sections(input_html):
+    """按文件夹生成导航 HTML：每个文件夹一个分类，只包含直接位于其中的书签，
+    子文件夹的书签归入子文件夹自己的分类。input_html 为字符串或已打开的文件"""
+    return "".join(iter_navigation_sections(input_html))
+
+# HTML 模板，包含动态 CSS 效果和搜索框功能；分类部分插在 HTML_HEAD 和 HTML_TAIL 之间
+HTML_HEAD = '''<!DOCTYPE html>
 <html lang="zh-CN">
 <head>
   <meta charset="UTF-8">
   <title>网址导航</title>
   <style>
     /* 基础样式 */
-    body {{
+    body {
       margin: 0;
       padding: 20px;
       font-family: "微软雅黑", Arial, sans-serif;
       background: #f7f9fc;
       color: #333;
-    }}
-    h1 {{
+    }
+    h1 {
       text-align: center;
       margin-bottom: 20px;
       font-size: 36px;
       color: #007BFF;
-    }}
+    }
     /* 搜索框样式 */
-    .search-box {{
+    .search-box {
       width: 100%;
       max-width: 500px;
       margin: 0 auto 40px;
-    }}
-    .search-box input {{
+    }
+    .search-box input {
       width: 100%;
       padding: 12px 20px;
       font-size: 16px;
@@ -63,27 +726,31 @@ def generate_full_html(navigation_sections):
       border-radius: 30px;
       outline: none;
       transition: border-color 0.3s;
-    }}
-    .search-box input:focus {{
+    }
+    .search-box input:focus {
       border-color: #007BFF;
-    }}
-    /* 分类样式 */
-    .category {{
+    }
+    /* 分类样式：按文件夹出现的先后用 order 排列，输出顺序可以与显示顺序不同 */
+    #navigation {
+      display: flex;
+      flex-direction: column;
+    }
+    .category {
       margin-bottom: 40px;
-    }}
-    .category h2 {{
+    }
+    .category h2 {
       background: linear-gradient(90deg, #007BFF, #00d4ff);
       color: #fff;
       padding: 10px 15px;
       border-radius: 5px;
       margin: 0 0 15px;
-    }}
-    .links {{
+    }
+    .links {
       display: flex;
       flex-wrap: wrap;
       gap: 15px;
-    }}
-    .link-item {{
+    }
+    .link-item {
       display: inline-block;
       background: #fff;
       padding: 10px 15px;
@@ -93,21 +760,33 @@ def generate_full_html(navigation_sections):
       box-shadow: 0 2px 5px rgba(0,0,0,0.1);
       transition: transform 0.3s, box-shadow 0.3s;
       animation: fadeIn 0.5s ease-in;
-    }}
-    .link-item:hover {{
+    }
+    .link-item:hover {
       transform: translateY(-5px) scale(1.02);
       box-shadow: 0 4px 10px rgba(0,0,0,0.2);
-    }}
-    @keyframes fadeIn {{
-      from {{
+    }
+    /* 链接检查标记 */
+    .link-dead {
+      color: #999;
+      text-decoration: line-through;
+    }
+    .link-unreachable {
+      color: #999;
+    }
+    .link-redirected::after {
+      content: " ↪";
+      color: #999;
+    }
+    @keyframes fadeIn {
+      from {
         opacity: 0;
         transform: translateY(10px);
-      }}
-      to {{
+      }
+      to {
         opacity: 1;
         transform: translateY(0);
-      }}
-    }}
+      }
+    }
   </style>
 </head>
 <body>
@@ -116,45 +795,637 @@ def generate_full_html(navigation_sections):
     <input type="text" id="search" placeholder="搜索网址...">
   </div>
   <div id="navigation">
-{navigation_sections}
-  </div>
+'''
+
+HTML_TAIL = '''  </div>
   <script>
     // 搜索功能：实时筛选链接（同时匹配名称和 URL）
-    const searchInput = document.getElementById('search');
-    searchInput.addEventListener('keyup', function() {{
-      const query = this.value.toLowerCase();
-      const linkItems = document.querySelectorAll('.link-item');
-      linkItems.forEach(item => {{
-        if(item.textContent.toLowerCase().includes(query) || item.href.toLowerCase().includes(query)) {{
-          item.style.display = 'inline-block';
-        }} else {{
-          item.style.display = 'none';
-        }}
-      }});
-    }});
+    // 索引由生成器预先算好（小写的“名称 换行 网址”，顺序与页面中的链接一致），没有索引时加载时从页面构建一次
+    (function() {
+      const items = Array.prototype.slice.call(document.getElementsByClassName('link-item'));
+      const indexElement = document.getElementById('search-index');
+      const index = indexElement ? JSON.parse(indexElement.textContent)
+        : items.map(item => (item.textContent + '\\n' + item.getAttribute('href')).toLowerCase());
+      const visible = new Uint8Array(items.length).fill(1);
+      const searchInput = document.getElementById('search');
+      let lastQuery = '';
+      let timer = null;
+
+      function apply(query) {
+        // 输入是在上次查询后追加字符时，只需检查当前可见的链接
+        const narrowing = query.startsWith(lastQuery);
+        const changes = [];
+        for (let i = 0; i < index.length; i++) {
+          if (narrowing && !visible[i]) continue;
+          const show = index[i].indexOf(query) !== -1 ? 1 : 0;
+          if (show !== visible[i]) {
+            visible[i] = show;
+            changes.push(i);
+          }
+        }
+        lastQuery = query;
+        // 只改动可见性变化的元素，并在同一帧内批量更新
+        requestAnimationFrame(() => {
+          for (const i of changes) {
+            items[i].style.display = visible[i] ? '' : 'none';
+          }
+        });
+      }
+
+      searchInput.addEventListener('input', function() {
+        const query = this.value.toLowerCase();
+        clearTimeout(timer);
+        timer = setTimeout(() => {
+          if (query !== lastQuery) apply(query);
+        }, 150);
+      });
+    })();
   </script>
 </body>
 </html>
 '''
-    return html_template
 
-if __name__ == "__main__":
-    input_filename = "bookmarks_2025_3_16.html"
-    output_filename = "navigation_output.html"
+# 懒加载模式的页面尾部：书签数据以 JSON 内嵌，分类和链接进入视口附近时才创建 DOM
+LAZY_TAIL = '''  </div>
+  <div id="results" class="category" style="display: none">
+    <h2 id="results-title"></h2>
+    <div class="links" id="results-links"></div>
+  </div>
+  <style>
+    /* 懒加载模式：链接分批出现，不再逐个播放淡入动画 */
+    .link-item {
+      animation: none;
+    }
+  </style>
+  <script>
+    // 懒加载渲染：每个分类先只创建标题和按链接数估算高度的占位块，
+    // 占位块接近视口时才分批创建链接；搜索直接在数据上进行，只渲染前 RESULT_LIMIT 个结果
+    (function() {
+      const ROW_BATCH = 200;
+      const RESULT_LIMIT = 500;
+      const data = JSON.parse(document.getElementById('bookmark-data').textContent)
+        .sort((a, b) => a.o - b.o);
+      const navigation = document.getElementById('navigation');
+      const results = document.getElementById('results');
+
+      function linkElement(link) {
+        const a = document.createElement('a');
+        a.href = link[1];
+        a.className = link[2] ? 'link-item link-' + link[2] : 'link-item';
+        a.target = '_blank';
+        a.textContent = link[0];
+        return a;
+      }
+
+      function estimateHeight(count) {
+        // 粗略按每行 6 个链接、行高 55px 估算，只用于让滚动条长度大致正确
+        return Math.ceil(count / 6) * 55;
+      }
+
+      const observer = new IntersectionObserver(entries => {
+        for (const entry of entries) {
+          if (entry.isIntersecting) renderMore(entry.target.category);
+        }
+      }, {rootMargin: '600px'});
+
+      function renderMore(category) {
+        const end = Math.min(category.rendered + ROW_BATCH, category.l.length);
+        const fragment = document.createDocumentFragment();
+        for (let i = category.rendered; i < end; i++) {
+          fragment.appendChild(linkElement(category.l[i]));
+        }
+        category.links.appendChild(fragment);
+        category.rendered = end;
+        observer.unobserve(category.sentinel);
+        if (end >= category.l.length) {
+          category.sentinel.remove();
+        } else {
+          // 重新观察以便占位块仍在视口内时立刻渲染下一批
+          category.sentinel.style.height = estimateHeight(category.l.length - end) + 'px';
+          observer.observe(category.sentinel);
+        }
+      }
+
+      const fragment = document.createDocumentFragment();
+      for (const category of data) {
+        const section = document.createElement('div');
+        section.className = 'category';
+        section.dataset.category = category.c;
+        const title = document.createElement('h2');
+        title.textContent = category.c;
+        category.links = document.createElement('div');
+        category.links.className = 'links';
+        category.sentinel = document.createElement('div');
+        category.sentinel.style.height = estimateHeight(category.l.length) + 'px';
+        category.sentinel.category = category;
+        category.rendered = 0;
+        section.append(title, category.links, category.sentinel);
+        fragment.appendChild(section);
+        observer.observe(category.sentinel);
+      }
+      navigation.appendChild(fragment);
+
+      let index = null;
+      function buildIndex() {
+        index = [];
+        for (const category of data) {
+          for (const link of category.l) {
+            index.push([(link[0] + '\\n' + link[1]).toLowerCase(), link]);
+          }
+        }
+      }
+
+      function search(query) {
+        if (!query) {
+          results.style.display = 'none';
+          navigation.style.display = '';
+          return;
+        }
+        if (!index) buildIndex();
+        const fragment = document.createDocumentFragment();
+        let total = 0;
+        for (const [text, link] of index) {
+          if (text.indexOf(query) === -1) continue;
+          if (total < RESULT_LIMIT) fragment.appendChild(linkElement(link));
+          total++;
+        }
+        document.getElementById('results-title').textContent =
+          total > RESULT_LIMIT ? `找到 ${total} 个结果（显示前 ${RESULT_LIMIT} 个）` : `找到 ${total} 个结果`;
+        document.getElementById('results-links').replaceChildren(fragment);
+        navigation.style.display = 'none';
+        results.style.display = '';
+      }
+
+      let timer = null;
+      document.getElementById('search').addEventListener('input', function() {
+        const query = this.value.toLowerCase();
+        clearTimeout(timer);
+        timer = setTimeout(() => search(query), 150);
+      });
+    })();
+  </script>
+</body>
+</html>
+'''
+
+# 分片模式的页面尾部：页面只内嵌分类清单，展开某个分类时才下载它的分片
+SHARDED_TAIL = '''  </div>
+  <div id="results" class="category" style="display: none">
+    <h2 id="results-title"></h2>
+    <div class="links" id="results-links"></div>
+  </div>
+  <style>
+    /* 分片模式：分类默认折叠，点击标题展开 */
+    .category h2 {
+      cursor: pointer;
+      user-select: none;
+    }
+    .category h2::before {
+      content: "▸ ";
+    }
+    .category.open h2::before {
+      content: "▾ ";
+    }
+    .category .count {
+      color: #999;
+      font-size: 0.7em;
+    }
+    .link-item {
+      animation: none;
+    }
+  </style>
+  <script>
+    // 分片加载：分类清单随页面下发，每个分类的链接是一个内容哈希命名的 JSON 分片，
+    // 第一次展开时才请求；分片内容不变文件名就不变，浏览器可以长期缓存
+    (function() {
+      const RESULT_LIMIT = 500;
+      const manifest = JSON.parse(document.getElementById('shard-manifest').textContent)
+        .sort((a, b) => a.o - b.o);
+      const navigation = document.getElementById('navigation');
+      const results = document.getElementById('results');
+      const shards = new Map();
+
+      function loadShard(entry) {
+        if (!shards.has(entry.f)) {
+          shards.set(entry.f, fetch(entry.f).then(response => {
+            if (!response.ok) throw new Error(response.status + ' ' + entry.f);
+            return response.json();
+          }).catch(error => {
+            shards.delete(entry.f);
+            throw error;
+          }));
+        }
+        return shards.get(entry.f);
+      }
+
+      function linkElement(link) {
+        const a = document.createElement('a');
+        a.href = link[1];
+        a.className = link[2] ? 'link-item link-' + link[2] : 'link-item';
+        a.target = '_blank';
+        a.textContent = link[0];
+        return a;
+      }
+
+      function renderLinks(container, links) {
+        const fragment = document.createDocumentFragment();
+        for (const link of links) fragment.appendChild(linkElement(link));
+        container.replaceChildren(fragment);
+      }
+
+      const fragment = document.createDocumentFragment();
+      for (const entry of manifest) {
+        const section = document.createElement('div');
+        section.className = 'category';
+        section.dataset.category = entry.c;
+        const title = document.createElement('h2');
+        const count = document.createElement('span');
+        count.className = 'count';
+        count.textContent = ' (' + entry.n + ')';
+        title.append(entry.c, count);
+        const links = document.createElement('div');
+        links.className = 'links';
+        title.addEventListener('click', () => {
+          if (section.classList.toggle('open')) {
+            links.style.display = '';
+            if (!links.firstChild) {
+              loadShard(entry).then(data => renderLinks(links, data.l), error => {
+                links.textContent = '加载失败：' + error.message;
+              });
+            }
+          } else {
+            links.style.display = 'none';
+          }
+        });
+        section.append(title, links);
+        fragment.appendChild(section);
+      }
+      navigation.appendChild(fragment);
 
+      // 搜索需要全部链接：第一次搜索时并行请求所有分片（之后都来自缓存）
+      let index = null;
+      function buildIndex() {
+        if (!index) {
+          index = Promise.all(manifest.map(loadShard)).then(all => {
+            const entries = [];
+            for (const data of all) {
+              for (const link of data.l) {
+                entries.push([(link[0] + '\\n' + link[1]).toLowerCase(), link]);
+              }
+            }
+            return entries;
+          });
+          index.catch(() => { index = null; });
+        }
+        return index;
+      }
+
+      let latest = '';
+      function search(query) {
+        latest = query;
+        if (!query) {
+          results.style.display = 'none';
+          navigation.style.display = '';
+          return;
+        }
+        buildIndex().then(entries => {
+          if (query !== latest) return;
+          const matches = [];
+          let total = 0;
+          for (const [text, link] of entries) {
+            if (text.indexOf(query) === -1) continue;
+            if (total < RESULT_LIMIT) matches.push(link);
+            total++;
+          }
+          document.getElementById('results-title').textContent =
+            total > RESULT_LIMIT ? `找到 ${total} 个结果（显示前 ${RESULT_LIMIT} 个）` : `找到 ${total} 个结果`;
+          renderLinks(document.getElementById('results-links'), matches);
+          navigation.style.display = 'none';
+          results.style.display = '';
+        }, error => {
+          document.getElementById('results-title').textContent = '加载失败：' + error.message;
+        });
+      }
+
+      let timer = null;
+      document.getElementById('search').addEventListener('input', function() {
+        const query = this.value.toLowerCase();
+        clearTimeout(timer);
+        timer = setTimeout(() => search(query), 150);
+      });
+    })();
+  </script>
+</body>
+</html>
+'''
+
+def generate_full_html(navigation_sections):
+    return HTML_HEAD + navigation_sections + "\n" + HTML_TAIL
+
+def page_head(stylesheet=None):
+    """页面开头部分；给出 stylesheet 时在 <head> 中引用这个外部样式表（如图标样式表）"""
+    if stylesheet is None:
+        return HTML_HEAD
+    return HTML_HEAD.replace("</head>", f'  <link rel="stylesheet" href="{escape(stylesheet)}">\n</head>', 1)
+
+def write_full_html(output, sections, search_index=None, stylesheet=None):
+    """把页面逐段写入已打开的文本文件，sections 为分类 HTML 片段的可迭代对象；
+    search_index 在所有分类写完后写入页面"""
+    output.write(page_head(stylesheet))
+    for section in sections:
+        output.write(section)
+    output.write("\n")
+    if search_index is not None:
+        search_index.write_script(output)
+    output.write(HTML_TAIL)
+
+def write_navigation_page(output, folders, stylesheet=None):
+    """由文件夹序列（iter_folders 或 merge_exports 的结果）生成完整的导航页面（含预计算的搜索索引）"""
+    search_index = SearchIndexSpool()
     try:
-        with open(input_filename, "r", encoding="utf-8") as f:
-            input_html = f.read()
-    except FileNotFoundError:
-        print(f"文件 {input_filename} 未找到，请确保该文件在当前目录下。")
-        exit(1)
+        write_full_html(output, render_sections(folders, search_index), search_index, stylesheet)
+    finally:
+        search_index.close()
+
+def lazy_category(path, order, links):
+    """懒加载页面中一个分类的 JSON 数据 {"c": 分类名, "o": 序号, "l": [[标题, 网址], ...]}"""
+    return script_json(json.dumps({"c": " / ".join(path), "o": order, "l": links}, ensure_ascii=False))
+
+def write_lazy_categories(output, categories, stylesheet=None):
+    """写出懒加载版页面，categories 为 lazy_category 生成的各分类 JSON"""
+    output.write(page_head(stylesheet))
+    output.write('    <script type="application/json" id="bookmark-data">[')
+    for number, category in enumerate(categories):
+        if number:
+            output.write(",\n")
+        output.write(category)
+    output.write(']</script>\n')
+    output.write(LAZY_TAIL)
+
+def write_lazy_page(output, folders, stylesheet=None):
+    """生成懒加载版导航页面：分类数据以 JSON 内嵌，由页面脚本按需创建 DOM。
+    folders 为流式产出时边解析边写出，内存与书签总数无关"""
+    write_lazy_categories(output, (lazy_category(*folder) for folder in folders), stylesheet)
+
+def precompress(filename, data):
+    """在 filename 旁边写出预压缩的 .gz 和 .br，供 Web 服务器直接发送（如 nginx 的 gzip_static / brotli_static）。
+    没装 brotli 时只写 .gz"""
+    compressed = [(".gz", lambda: gzip.compress(data, 9, mtime=0))]
+    try:
+        import brotli
+    except ImportError:
+        pass
+    else:
+        compressed.append((".br", lambda: brotli.compress(data, quality=BROTLI_QUALITY)))
+    for suffix, compress in compressed:
+        write_atomic(filename + suffix, compress())
+
+def write_atomic(filename, data):
+    """先写临时文件再改名，半途中断不会留下内容不完整的文件"""
+    temp_filename = f"{filename}.tmp"
+    with open(temp_filename, "wb") as f:
+        f.write(data)
+    os.replace(temp_filename, filename)
+
+def write_shard(shard_dir, path, order, links):
+    """把一个分类写成内容哈希命名的 JSON 分片（连同 .gz、.br），返回它在分类清单中的条目
+    {"c": 分类名, "o": 序号, "n": 链接数, "f": 分片网址}。同样内容的分片已存在时不再重写；
+    旧分片也不删除，还开着旧页面的用户仍能取到"""
+    # 分片里不放序号（页面按清单排序），文件夹挪了位置分片内容不变，文件名也不变
+    data = json.dumps({"c": " / ".join(path), "l": links}, ensure_ascii=False).encode("utf-8")
+    name = f"{hashlib.sha256(data).hexdigest()[:SHARD_HASH_LENGTH]}.json"
+    filename = os.path.join(shard_dir, name)
+    if not os.path.exists(filename):
+        precompress(filename, data)
+        # 分片文件最后写，有它就说明压缩版本也齐了
+        write_atomic(filename, data)
+    return {"c": " / ".join(path), "o": order, "n": len(links), "f": f"{SHARD_DIR}/{name}"}
+
+def write_sharded_manifest(output, entries, stylesheet=None):
+    """写出分片模式的页面：只内嵌分类清单，链接在各分片里"""
+    output.write(page_head(stylesheet))
+    output.write('    <script type="application/json" id="shard-manifest">[')
+    for number, entry in enumerate(entries):
+        if number:
+            output.write(",\n")
+        output.write(script_json(json.dumps(entry, ensure_ascii=False)))
+    output.write(']</script>\n')
+    output.write(SHARDED_TAIL)
 
-    # 解析书签文件并生成各分类下的导航部分
-    nav_sections = generate_navigation_sections(input_html)
-    # 生成完整的 HTML 页面
-    full_html = generate_full_html(nav_sections)
+def write_sharded_page(output, folders, stylesheet=None, shard_dir=SHARD_DIR):
+    """生成分片版导航页面：每个分类一个 JSON 分片写到 shard_dir，页面本身只有分类清单，
+    浏览器只下载用户展开的分类"""
+    os.makedirs(shard_dir, exist_ok=True)
+    write_sharded_manifest(output, (write_shard(shard_dir, *folder) for folder in folders), stylesheet)
+
+class FragmentCache:
+    """监视模式下跨多次生成保留的分类片段：以文件夹内容（路径、链接）的哈希为键，
+    内容没变的分类直接复用上次渲染好的 HTML（或懒加载模式的 JSON、分片模式的清单条目）和搜索索引行，
+    只渲染变化了的。序号不进片段，输出时再填进去，前面插入一个文件夹不会让后面的全部重新渲染。
+    哈希只在本进程内使用，不写盘"""
+
+    def __init__(self, mode="static", shard_dir=SHARD_DIR):
+        self.mode = mode
+        self.shard_dir = shard_dir
+        self.fragments = {}
+        self.index_lines = []
+        self.rendered = 0  # 最近一次生成中重新渲染的分类数
+
+    def render(self, path, links):
+        """渲染与序号无关的片段：按序号 0 渲染，再从序号处切开，输出时由 place 填入实际序号。
+        分类名和标题在 HTML 属性和 JSON 字符串里都转义了引号，切开的位置不会落在它们中间"""
+        if self.mode == "lazy":
+            head, _, tail = lazy_category(path, 0, links).partition(', "o": 0, ')
+            return head, tail
+        if self.mode == "sharded":
+            return write_shard(self.shard_dir, path, 0, links)
+        head, _, tail = render_section(path, 0, links).partition('style="order: 0"')
+        return head, tail, search_index_line(links)
+
+    def place(self, fragment, order):
+        """把序号填回片段，得到与 render_section / lazy_category / write_shard 相同的结果"""
+        if self.mode == "lazy":
+            head, tail = fragment
+            return f'{head}, "o": {order}, {tail}'
+        if self.mode == "sharded":
+            return dict(fragment, o=order)
+        head, tail, line = fragment
+        return f'{head}style="order: {order}"{tail}', line
+
+    def iter_fragments(self, folders):
+        """逐个产出各文件夹的片段；只保留本次用到的片段，删掉的分类不会一直占着内存"""
+        previous, self.fragments = self.fragments, {}
+        self.rendered = 0
+        for path, order, links in folders:
+            key = hash((path, tuple(links)))
+            fragment = previous.get(key)
+            if fragment is None:
+                fragment = self.render(path, links)
+                self.rendered += 1
+            self.fragments[key] = fragment
+            yield self.place(fragment, order)
+
+    def iter_sections(self, folders):
+        """静态页面的分类 HTML，同时按顺序收集搜索索引行"""
+        self.index_lines = []
+        for section, line in self.iter_fragments(folders):
+            if line is not None:
+                self.index_lines.append(line)
+            yield section
+
+    def write_script(self, output):
+        """把本次收集的搜索索引写进页面，供 write_full_html 调用"""
+        write_search_index(output, self.index_lines)
+
+    def write_page(self, output, folders, stylesheet=None):
+        """与 write_navigation_page / write_lazy_page / write_sharded_page 相同，但复用未变化分类的片段"""
+        if self.mode == "lazy":
+            write_lazy_categories(output, self.iter_fragments(folders), stylesheet)
+        elif self.mode == "sharded":
+            os.makedirs(self.shard_dir, exist_ok=True)
+            write_sharded_manifest(output, self.iter_fragments(folders), stylesheet)
+        else:
+            write_full_html(output, self.iter_sections(folders), self, stylesheet)
+
+def open_output(filename):
+    """打开输出文件；以 .gz 结尾时写 gzip 压缩流"""
+    if filename.endswith(".gz"):
+        return gzip.open(filename, "wt", encoding="utf-8")
+    return open(filename, "w", encoding="utf-8")
+
+def build(args, cache=None):
+    """按命令行参数生成一次导航页面；给出 cache（FragmentCache）时只重新渲染有变化的分类。
+    页面先写到同目录下的临时文件再替换，正在访问页面的用户不会读到写了一半的文件"""
+    output_filename = args.output
+    shard_dir = os.path.join(os.path.dirname(output_filename), SHARD_DIR)
+    if cache is not None:
+        write_page = cache.write_page
+    elif args.mode == "sharded":
+        write_page = functools.partial(write_sharded_page, shard_dir=shard_dir)
+    else:
+        write_page = write_lazy_page if args.mode == "lazy" else write_navigation_page
+    stylesheet = favicon_stylesheet_name(output_filename) if args.favicons else None
+    stylesheet_href = os.path.basename(stylesheet) if stylesheet else None
+    origins = set()
+    directory, name = os.path.split(output_filename)
+    # 临时文件保留原文件名结尾，.gz 输出照样写成压缩文件
+    temp_filename = os.path.join(directory, f".tmp-{name}")
+
+    def write(folders):
+        if stylesheet:
+            folders = collect_origins(folders, origins)
+        try:
+            with open_output(temp_filename) as output:
+                write_page(output, folders, stylesheet_href)
+        except BaseException:
+            # 解析或写入中途失败时不留下写了一半的临时文件
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+            raise
+
+    if len(args.input) > 1:
+        # 多个导出文件：先并行解析并去重，再生成页面
+        folders = merge_exports(args.input, args.parser, args.workers, args.format)
+        if args.check:
+            states = check_links(href for path, order, links in folders for title, href in links)
+            folders = mark_links(folders, states, args.check == "prune")
+        write(folders)
+    else:
+        # 边读边解析书签文件，各分类生成后直接写入输出文件
+        input_filename = args.input[0]
+        if args.check:
+            # 先扫一遍收集网址并检查，再从头读一遍生成页面
+            states = check_links({href for path, title, href in iter_bookmark_file(input_filename, args.parser, args.format)})
+        folders = iter_folder_links(iter_bookmark_file(input_filename, args.parser, args.format))
+        if args.check:
+            folders = mark_links(folders, states, args.check == "prune")
+        write(folders)
+    os.replace(temp_filename, output_filename)
+    if args.mode == "sharded":
+        # 页面本身不带内容哈希（入口网址要固定），也一并预压缩
+        with open(output_filename, "rb") as f:
+            precompress(output_filename, f.read())
+
+    if stylesheet:
+        # 页面写完后再抓取图标：页面只按网址前缀引用样式表，不依赖抓取结果
+        icons = load_favicons(origins)
+        with open(stylesheet, "w", encoding="utf-8") as output:
+            write_favicon_stylesheet(output, icons)
+        print(f"已取得 {len(icons)}/{len(origins)} 个网站图标，保存到 {stylesheet} 文件中。")
+
+def input_signature(filenames):
+    """各输入文件的 (修改时间, 大小)，用来判断是否需要重新生成；
+    places.sqlite 的修改先写进 -wal 文件，也一并比较"""
+    signature = []
+    for filename in filenames:
+        if os.path.exists(filename + "-wal"):
+            stat = os.stat(filename + "-wal")
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        try:
+            stat = os.stat(filename)
+        except FileNotFoundError:
+            # 浏览器导出时可能先删后写，文件暂时不存在
+            signature.append(None)
+        else:
+            signature.append((stat.st_mtime_ns, stat.st_size))
+    return signature
+
+def watch(args, interval=WATCH_INTERVAL):
+    """监视输入文件，有变化就增量重新生成页面，直到按 Ctrl+C。
+    增量只省掉没变的分类的渲染：导出文件是单个文件，每次仍要整个重新解析并重写整个页面，
+    所以重新生成的用时随导出文件大小增长（1k 个链接约几十毫秒，2 万个约半秒到一秒）"""
+    cache = FragmentCache(args.mode, os.path.join(os.path.dirname(args.output), SHARD_DIR))
+    signature = input_signature(args.input)
+    build(args, cache)
+    print(f"导航页面已生成并保存到 {args.output} 文件中，正在监视输入文件的变化（Ctrl+C 退出）。")
+    try:
+        while True:
+            time.sleep(interval)
+            current = input_signature(args.input)
+            if current == signature or None in current:
+                continue
+            signature = current
+            started = time.perf_counter()
+            try:
+                build(args, cache)
+            except (OSError, ValueError, sqlite3.Error) as e:
+                # 文件保存到一半、places.sqlite 正被浏览器改写等情况，等下次变化再试
+                print(f"重新生成失败: {e}")
+                continue
+            elapsed = (time.perf_counter() - started) * 1000
+            print(f"已重新生成 {args.output}：{cache.rendered}/{len(cache.fragments)} 个分类有变化，用时 {elapsed:.0f} ms")
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="书签生成网址导航")
+    arg_parser.add_argument("input", nargs="*", default=["bookmarks_2025_3_16.html"],
+                            help="书签文件：浏览器导出的 HTML、Chromium 的 Bookmarks 或 Firefox 的 places.sqlite；"
+                                 "给出多个时并行解析、按网址去重后合并为一个页面")
+    arg_parser.add_argument("-o", "--output", default="navigation_output.html",
+                            help="输出文件，以 .gz 结尾时直接写 gzip 压缩文件")
+    arg_parser.add_argument("--format", choices=INPUT_FORMATS, default="auto", help="书签文件格式，默认按文件内容判断")
+    arg_parser.add_argument("--parser", choices=sorted(PARSERS), default="fast", help="书签解析后端")
+    arg_parser.add_argument("--workers", type=int, default=MERGE_WORKERS, help="合并多个书签文件时的解析进程数")
+    arg_parser.add_argument("--favicons", action="store_true",
+                            help="抓取各网站图标（需要 aiohttp），写成与页面同名的 .icons.css 样式表；结果缓存在 favicons.sqlite3")
+    arg_parser.add_argument("--check", choices=("mark", "prune"),
+                            help="先检查所有链接（需要 aiohttp，结果缓存在 links.sqlite3）：mark 标出失效、无法访问和跳转的链接，prune 去掉失效（404/410）的链接")
+    arg_parser.add_argument("--mode", choices=("static", "lazy", "sharded"), default="static",
+                            help="static 生成所有链接的完整页面；lazy 内嵌 JSON 数据，滚动到附近时才渲染，适合海量书签；"
+                                 "sharded 每个分类写成一个带内容哈希的 JSON 分片（含 .gz/.br），页面只在展开分类时下载")
+    arg_parser.add_argument("--watch", action="store_true",
+                            help="生成后继续监视输入文件，有变化时只重新渲染变化了的分类；"
+                                 "每次仍会重新解析整个输入文件并重写页面，用时随书签数量增长")
+    args = arg_parser.parse_args()
 
-    with open(output_filename, "w", encoding="utf-8") as f:
-        f.write(full_html)
+    for input_filename in args.input:
+        if not os.path.isfile(input_filename):
+            print(f"文件 {input_filename} 未找到，请确保该文件在当前目录下。")
+            exit(1)
 
-    print(f"导航页面已生成并保存到 {output_filename} 文件中。")
+    if args.watch:
+        watch(args)
+        exit(0)
+    build(args)
+    print(f"导航页面已生成并保存到 {args.output} 文件中。")